@@ -1,38 +1,23 @@
 from django.shortcuts import render
 from django.shortcuts import redirect
 from django.contrib.auth import get_user_model
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.contrib.auth import authenticate, login, logout
 from django.http import HttpResponseRedirect
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
 
+from project.pagination import paginate
+
 from .forms import SignupForm, SinginForm, EditProfileForm, EditAccountForm, EditSettingsForm
 from .settings import REMEMBER_ME_DAYS, LOGIN_REDIRECT_URL
 from .models import AccountSignup, Profile
 
 
 def profile_list(request):
-	users = User.objects.all()
-
-	page = request.GET.get('page', 1)
-	paginator = Paginator(users, 20)
-	adjacent_pages = 5
-	page = int(page)
-	start_page = max(page - adjacent_pages, 1)
-	if start_page <= 3: start_page = 1
-	end_page = page + adjacent_pages + 1
-	if end_page >= paginator.num_pages - 1: end_page = page + 1
-	try:
-		users = paginator.page(page)
-	except PageNotAnInteger:
-		users = paginator.page(1)
-	except EmptyPage:
-		users = paginator.page(paginator.num_pages)
+	users = paginate(request, User.objects.all(), ['username', 'pk'])
 
 	context = {
 		'users': users,
-		'paginator_range': range(start_page, end_page),
 	}
 	return render(request, "profile-list.html", context)
 
@@ -0,0 +1,19 @@
+"""
+Celery application of the project, crawl tasks are in :mod:`quaero.tasks`.
+Start workers with:
+	celery -A project worker -c 1 -Q crawl-0,crawl-1,nlp
+each worker of crawl queues must be a single process, since crawlers and their politeness scheduler are kept
+in memory of the process, see :mod:`quaero.tasks`. crawl faster by starting more workers on other crawl queues.
+and periodic tasks, like rebuilding query suggestions, with:
+	celery -A project beat
+"""
+
+import os
+
+from celery import Celery
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "project.settings")
+
+app = Celery('project')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
@@ -0,0 +1,59 @@
+import time
+
+from bs4 import BeautifulSoup
+from django.core.management.base import BaseCommand
+from newspaper import Article
+
+from quaero.models import Page, Blob
+from quaero.parser import ParsedPage
+
+
+def legacy_parse(url, html):
+	# html parsing done by Page.scrap before single parse pipeline
+	article = Article(url)
+	article.set_html(html)
+	article.parse()
+	soup = BeautifulSoup(html, "html5lib")
+	images = [(img.get('src', ''), img.get('title', ''), img.get('alt', '')) for img in soup.findAll("img")]
+	links = [(link.get('href'), link.get('title'), link.get('rel')) for link in soup.find_all('a')]
+	return soup.title, images, links
+
+
+def single_parse(url, html):
+	parsed = ParsedPage(url, html)
+	return parsed.title, parsed.images, parsed.links
+
+
+class Command(BaseCommand):
+	help = 'compare cpu time per page of html parsing, before and after single parse pipeline'
+
+	def add_arguments(self, parser):
+		parser.add_argument('files', nargs='*', type=str, help='html files, crawled pages are used if no file is given')
+		parser.add_argument('--pages', type=int, dest='pages', default=50, help='number of crawled pages to parse')
+		parser.add_argument('--repeat', type=int, dest='repeat', default=3)
+
+	def handle(self, *args, **options):
+		if options['files']:
+			documents = []
+			for path in options['files']:
+				with open(path, encoding='utf-8', errors='replace') as f:
+					documents.append(("http://localhost/{}".format(path), f.read()))
+		else:
+			pages = list(Page.objects.select_related('site').filter(content_type__contains="text/html")
+						.exclude(content_hash=None)[:options['pages']])
+			# raw html of pages is loaded from blob store with one query
+			contents = Blob.get_texts(page.content_hash for page in pages)
+			documents = [(page.get_url(), contents[page.content_hash]) for page in pages if page.content_hash in contents]
+		if not documents:
+			print("No page to parse.")
+			return
+
+		for name, parse in (("html5lib + newspaper", legacy_parse), ("single lxml parse", single_parse)):
+			best = None
+			for i in range(options['repeat']):
+				start = time.process_time()
+				for url, html in documents:
+					parse(url, html)
+				elapsed = time.process_time() - start
+				best = elapsed if best is None else min(best, elapsed)
+			print("{}: {:.2f} ms cpu per page".format(name, best * 1000 / len(documents)))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from quaero.cache import search_cache
+from quaero.index import Index
+from quaero.models import Page
+
+
+class Command(BaseCommand):
+	help = 'build inverted index of crawled pages, used by search when SEARCH_BACKEND is "index"'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--path', type=str, dest='path', default=None, help='index directory, default is SEARCH_INDEX_DIR setting')
+		parser.add_argument('--segment-size', type=int, dest='segment_size', default=None,
+							help='maximum number of pages in a segment, default is SEARCH_INDEX_SEGMENT_SIZE setting')
+
+	def handle(self, *args, **options):
+		index = Index(options['path'])
+		# pages are streamed from database, so whole content of pages is never loaded at once
+		documents = Page.objects.filter(status=200).order_by('pk')\
+			.values_list('pk', 'page_title', 'article_content').iterator()
+		index.build(documents, options['segment_size'])
+		index.write_priors(Page.objects.values_list('pk', 'rank', 'backlinks').iterator())
+		print("Indexed pages: {}\nSegments: {}".format(len(index), len(index.segments)))
+		index.close()
+		search_cache.bump("pages")
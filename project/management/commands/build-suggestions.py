@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from quaero.suggest import build_suggestions
+
+
+class Command(BaseCommand):
+	help = 'build query suggestions of search box from keywords, page titles and searched queries'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--path', type=str, dest='path', default=None, help='suggestions file, default is SUGGEST_PATH setting')
+
+	def handle(self, *args, **options):
+		suggester = build_suggestions(options['path'])
+		print("Suggested phrases: {}".format(len(suggester)))
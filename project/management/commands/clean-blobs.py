@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from project import settings
+from quaero.models import Page, Blob
+
+
+class Command(BaseCommand):
+	help = 'delete stored raw contents which no page has anymore'
+
+	def handle(self, *args, **options):
+		# contents stored recently are kept, a crawler may be saving the page which refers to it
+		blobs = Blob.objects.filter(stored__lt=timezone.now() - timedelta(seconds=settings.BLOB_CLEAN_GRACE))
+		deleted, rows = blobs.exclude(pk__in=Page.objects.filter(content_hash__isnull=False).values('content_hash')).delete()
+		print("Deleted contents: {}".format(deleted))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from project import settings
+from quaero.cache import search_cache
+from quaero.index import get_index
+from quaero.models import Page
+from quaero.pagerank import load_graph, pagerank, save_ranks
+
+
+class Command(BaseCommand):
+	help = 'compute PageRank of pages over their links, and store it in Page.rank'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--damping', type=float, dest='damping', default=settings.PAGERANK_DAMPING)
+		parser.add_argument('--tolerance', type=float, dest='tolerance', default=settings.PAGERANK_TOLERANCE,
+							help='stop when sum of rank changes of an iteration is less than this')
+		parser.add_argument('--iterations', type=int, dest='iterations', default=settings.PAGERANK_ITERATIONS,
+							help='maximum number of iterations')
+
+	def handle(self, *args, **options):
+		page_ids, indptr, indices = load_graph()
+		print("Pages: {}\nLinks: {}".format(len(page_ids), len(indices)))
+		ranks, iterations = pagerank(indptr, indices, options['damping'], options['tolerance'], options['iterations'])
+		# ranks are scaled by number of pages, so an average page has rank 1 regardless of size of the graph
+		save_ranks(page_ids, ranks * len(page_ids))
+		search_cache.bump("pages")
+		print("Iterations: {}".format(iterations))
+		if settings.SEARCH_BACKEND == "index":
+			# inverted index keeps it's own copy of ranks, to order results without reading pages
+			get_index().write_priors(Page.objects.values_list('pk', 'rank', 'backlinks').iterator())
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery, IntegerField
+from django.db.models.functions import Coalesce
+
+from quaero.cache import search_cache
+from quaero.models import Page, Link
+
+
+class Command(BaseCommand):
+	help = 'recount backlinks of all pages, for links stored before backlinks were counted while crawling'
+
+	def handle(self, *args, **options):
+		backlinks = Link.objects.filter(to_url=OuterRef('pk')).order_by().values('to_url').annotate(count=Count('pk')).values('count')
+		updated = Page.objects.update(backlinks=Coalesce(Subquery(backlinks, output_field=IntegerField()), 0))
+		search_cache.bump("pages")
+		print("Updated pages: {}".format(updated))
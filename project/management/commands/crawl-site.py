@@ -1,5 +1,7 @@
 from django.core.management.base import BaseCommand
 from quaero.crawler import Crawler
+from quaero.fetcher import Fetcher
+from quaero.tasks import dispatch
 
 
 class Command(BaseCommand):
@@ -9,11 +11,30 @@ class Command(BaseCommand):
 		parser.add_argument('url', nargs=1, type=str)
 		parser.add_argument('depth', nargs=1, type=int)
 		parser.add_argument('external', nargs=1, type=bool)
+		parser.add_argument('--resume', action='store_true', dest='resume', default=False,
+							help='continue an interrupted crawl of this url from its frontier')
+		parser.add_argument('--concurrency', type=int, dest='concurrency', default=None,
+							help='maximum number of requests in flight, default is CRAWL_CONCURRENCY setting')
+		parser.add_argument('--visited', choices=['exact', 'bloom'], dest='visited', default=None,
+							help='how crawled urls are remembered, default is CRAWL_VISITED_MODE setting')
+		parser.add_argument('--distributed', action='store_true', dest='distributed', default=False,
+							help='queue the crawl for celery workers instead of crawling in this process')
 
 	def handle(self, *args, **options):
 		url = options['url'][0]
 		depth = options['depth'][0]
 		external = options['external'][0]
 		print("Crawling: {}\nWith the depth: {}".format(url, depth))
-		crawler = Crawler(url=url, depth=depth, external=external)
-		pass
+		if options['distributed']:
+			crawler = Crawler(url=url, depth=depth, external=external, start=False)
+			crawler.start(options['resume'])
+			dispatch.delay(url, external, options['concurrency'], options['visited'])
+			print("Crawl is queued for workers.")
+			return
+		fetcher = Fetcher(concurrency=options['concurrency'])
+		crawler = Crawler(
+			url=url, depth=depth, external=external, resume=options['resume'], fetcher=fetcher, visited_mode=options['visited']
+		)
+		print("Crawled pages: {}\nFound links: {}\nVisited urls hits/misses: {}/{}".format(
+			crawler.followed, crawler.links, crawler.visited_hits, crawler.visited_misses
+		))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from quaero.models import Page, Blob
+
+
+class Command(BaseCommand):
+	help = 'move raw html of pages crawled before blob store into blobs'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch', type=int, dest='batch', default=100, help='number of pages loaded at a time')
+
+	def handle(self, *args, **options):
+		pages = Page.objects.filter(raw_content__isnull=False).only('pk', 'raw_content').order_by('pk')
+		moved = 0
+		last = 0
+		while True:
+			batch = list(pages.filter(pk__gt=last)[:options['batch']])
+			if not batch:
+				break
+			with transaction.atomic():
+				for page in batch:
+					# hash is computed from content, it's not set for pages crawled before conditional requests
+					Page.objects.filter(pk=page.pk).update(content_hash=Blob.put(page.raw_content), raw_content=None)
+			moved += len(batch)
+			last = batch[-1].pk
+		print("Moved contents: {}".format(moved))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from quaero.cache import search_cache
+from quaero.models import Page, get_search_vector
+
+
+class Command(BaseCommand):
+	help = 'summarize and extract keywords of crawled articles which nlp is deferred for them'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch', type=int, dest='batch', default=100, help='number of pages loaded at a time')
+		parser.add_argument('--limit', type=int, dest='limit', default=None, help='maximum number of pages to process')
+
+	def handle(self, *args, **options):
+		pages = Page.objects.filter(article_excerpt__isnull=True, article_content__isnull=False)\
+			.only('pk', 'article_title', 'article_content').order_by('pk')
+		processed = 0
+		last = 0
+		while options['limit'] is None or processed < options['limit']:
+			batch = list(pages.filter(pk__gt=last)[:options['batch']])
+			if not batch:
+				break
+			done = []
+			for page in batch:
+				page.process_nlp()
+				# save only nlp fields, so last_crawled stays the same
+				page.save(update_fields=['article_excerpt', 'article_keywords'])
+				done.append(page.pk)
+				processed += 1
+				if processed == options['limit']:
+					break
+			# keywords are part of search document
+			Page.objects.filter(pk__in=done).update(search_vector=get_search_vector())
+			last = batch[-1].pk
+		search_cache.bump("pages")
+		print("Processed pages: {}".format(processed))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from project import settings
+from quaero.crawler import Crawler
+from quaero.fetcher import Fetcher
+from quaero.revisit import REVISIT_CRAWL, queue_revisits
+from quaero.tasks import dispatch
+
+
+class Command(BaseCommand):
+	help = 'recrawl pages which have probably changed since their last crawl, pages that change more often first'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--budget', type=int, dest='budget', default=settings.REVISIT_BUDGET,
+							help='maximum number of pages to recrawl')
+		parser.add_argument('--concurrency', type=int, dest='concurrency', default=None,
+							help='maximum number of requests in flight, default is CRAWL_CONCURRENCY setting')
+		parser.add_argument('--distributed', action='store_true', dest='distributed', default=False,
+							help='queue the pages for celery workers instead of crawling in this process')
+
+	def handle(self, *args, **options):
+		queued = queue_revisits(options['budget'])
+		print("Due pages: {}".format(queued))
+		if options['distributed']:
+			dispatch.delay(REVISIT_CRAWL, True)
+			print("Revisits are queued for workers.")
+			return
+		# links of revisited pages aren't followed, they're revisited when they're due themselves
+		crawler = Crawler(url=REVISIT_CRAWL, depth=1, external=True, fetcher=Fetcher(concurrency=options['concurrency']), start=False)
+		crawler.run()
+		print("Crawled pages: {}".format(crawler.followed))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from quaero.cache import search_cache
+from quaero.models import Page, ImageDetail, get_search_vector, get_image_search_vector
+
+
+class Command(BaseCommand):
+	help = 'compute full text search document of pages and images crawled before search index existed'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch', type=int, dest='batch', default=1000, help='number of pages updated at a time')
+		parser.add_argument('--all', action='store_true', dest='all', default=False,
+							help='update every page, not only the ones without search document')
+
+	def handle(self, *args, **options):
+		pages = Page.objects.order_by('pk')
+		if not options['all']:
+			pages = pages.filter(search_vector__isnull=True)
+		updated = 0
+		last = 0
+		while True:
+			ids = list(pages.filter(pk__gt=last).values_list('pk', flat=True)[:options['batch']])
+			if not ids:
+				break
+			updated += Page.objects.filter(pk__in=ids).update(search_vector=get_search_vector())
+			last = ids[-1]
+		search_cache.bump("pages")
+		print("Updated pages: {}".format(updated))
+
+		# documents of images contain titles of their page, so they are updated page by page
+		details = ImageDetail.objects.all()
+		if not options['all']:
+			details = details.filter(search_vector__isnull=True)
+		updated = 0
+		for page in Page.objects.filter(pk__in=details.values('page')).only('pk', 'page_title', 'article_title').iterator():
+			updated += ImageDetail.objects.filter(page=page).update(search_vector=get_image_search_vector(page))
+		search_cache.bump("images")
+		print("Updated images: {}".format(updated))
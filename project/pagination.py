@@ -0,0 +1,240 @@
+"""
+Keyset(cursor) pagination, used by listing and search views instead of ``Paginator``.
+A page is found by filtering rows after the last row of previous page, on the ordering columns,
+so it's cost doesn't depend on how deep the page is, and total count is estimated by the planner.
+"""
+import base64
+import binascii
+import json
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.http import QueryDict
+
+from project import settings
+
+
+def encode_cursor(values):
+	return base64.urlsafe_b64encode(json.dumps(values, cls=DjangoJSONEncoder).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+	"""
+	:return: list of values, None if cursor is invalid
+	"""
+	try:
+		values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+	except (ValueError, TypeError, binascii.Error):
+		return None
+	return values if isinstance(values, list) else None
+
+
+def estimate_count(queryset):
+	"""
+	Number of rows estimated by postgres, from table statistics for a whole table, or from query plan.
+	:return: estimated count, None if table isn't analyzed yet
+	"""
+	connection = connections[queryset.db]
+	with connection.cursor() as cursor:
+		if not queryset.query.where:
+			cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [queryset.model._meta.db_table])
+			row = cursor.fetchone()
+			return int(row[0]) if row and row[0] > 0 else None
+		sql, params = queryset.order_by().query.sql_with_params()
+		cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+		plan = cursor.fetchone()[0]
+		if isinstance(plan, str):
+			plan = json.loads(plan)
+		return int(plan[0]['Plan']['Plan Rows'])
+
+
+def get_count(queryset, approximate=None):
+	"""
+	:param approximate: estimate count of big results, default is PAGINATION_APPROXIMATE_COUNT setting.
+		Results estimated to be smaller than PAGINATION_EXACT_COUNT_LIMIT are counted exactly.
+	"""
+	approximate = settings.PAGINATION_APPROXIMATE_COUNT if approximate is None else approximate
+	if approximate:
+		estimate = estimate_count(queryset)
+		if estimate is not None and estimate >= settings.PAGINATION_EXACT_COUNT_LIMIT:
+			return estimate
+	return queryset.count()
+
+
+class KeysetPage(object):
+	"""
+	Page of results, with the parts of ``django.core.paginator.Page`` interface which templates use.
+	``next_query``, ``previous_query`` and ``first_query`` are query strings of other pages.
+	"""
+	def __init__(self, object_list, paginator, next_query=None, previous_query=None, first_query=None, count=None):
+		self.object_list = object_list
+		self.paginator = paginator
+		self.next_query = next_query
+		self.previous_query = previous_query
+		self.first_query = first_query
+		self._count = count
+
+	def get_state(self):
+		"""
+		Picklable state of the page, for caching it. Objects are kept by their primary keys.
+		"""
+		return {
+			'ids': [item.pk for item in self.object_list],
+			'next_query': self.next_query,
+			'previous_query': self.previous_query,
+			'first_query': self.first_query,
+			'count': self.count,
+		}
+
+	@classmethod
+	def from_state(cls, state, queryset):
+		items = queryset.in_bulk(state['ids'])
+		return cls(
+			[items[pk] for pk in state['ids'] if pk in items], None,
+			state['next_query'], state['previous_query'], state['first_query'], state['count']
+		)
+
+	def __iter__(self):
+		return iter(self.object_list)
+
+	def __len__(self):
+		return len(self.object_list)
+
+	def __getitem__(self, index):
+		return self.object_list[index]
+
+	@property
+	def count(self):
+		if self._count is None:
+			self._count = self.paginator.count
+		return self._count
+
+	def has_next(self):
+		return self.next_query is not None
+
+	def has_previous(self):
+		return self.previous_query is not None
+
+	def has_other_pages(self):
+		return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator(object):
+	"""
+	:param object_list: a queryset, or an object with ``fetch(values, reverse, limit)`` and ``count()``
+		methods for results which aren't in database, see :class:`quaero.index.SearchResults`
+	:param ordering: fields which results are ordered by, like ``order_by()`` arguments, last one must be unique
+	"""
+	def __init__(self, object_list, ordering, per_page=20, approximate_count=None):
+		self.object_list = object_list
+		self.ordering = list(ordering)
+		self.per_page = per_page
+		self.approximate_count = approximate_count
+		self._count = None
+
+	@property
+	def count(self):
+		if self._count is None:
+			if hasattr(self.object_list, 'fetch'):
+				self._count = self.object_list.count()
+			else:
+				self._count = get_count(self.object_list, self.approximate_count)
+		return self._count
+
+	def get_values(self, item):
+		return [getattr(item, field.lstrip('-')) for field in self.ordering]
+
+	def is_nullable(self, name):
+		try:
+			return self.object_list.model._meta.get_field(name).null
+		except FieldDoesNotExist:
+			return False  # annotations and pk
+
+	def get_after_filter(self, name, value, descending):
+		# postgres puts nulls last in ascending order, and first in descending order
+		if value is None:
+			return Q(**{name + '__isnull': False}) if descending else None
+		if descending:
+			return Q(**{name + '__lt': value})
+		if self.is_nullable(name):
+			return Q(**{name + '__gt': value}) | Q(**{name + '__isnull': True})
+		return Q(**{name + '__gt': value})
+
+	def get_filter(self, values, reverse=False):
+		"""
+		Rows after values in ordering, or before them if ``reverse`` is set.
+		e.g. (a > x) or (a = x and b > y) for ordering of a, b
+		"""
+		result = None
+		equal = Q()
+		for field, value in zip(self.ordering, values):
+			name = field.lstrip('-')
+			condition = self.get_after_filter(name, value, field.startswith('-') != reverse)
+			if condition is not None:
+				condition = equal & condition
+				result = condition if result is None else result | condition
+			equal &= Q(**{name + '__isnull': True}) if value is None else Q(**{name: value})
+		return result
+
+	def fetch(self, values, reverse, limit):
+		if hasattr(self.object_list, 'fetch'):
+			return self.object_list.fetch(values, reverse, limit)
+		queryset = self.object_list
+		if reverse:
+			queryset = queryset.order_by(*[field[1:] if field.startswith('-') else '-' + field for field in self.ordering])
+		else:
+			queryset = queryset.order_by(*self.ordering)
+		if values is not None:
+			condition = self.get_filter(values, reverse)
+			if condition is None:
+				return []
+			queryset = queryset.filter(condition)
+		return list(queryset[:limit])
+
+	def page(self, after=None, before=None, query=None):
+		"""
+		:param after: cursor of last row of previous page
+		:param before: cursor of first row of next page
+		:param query: QueryDict of current request, to keep other parameters in links of pages
+		"""
+		values = decode_cursor(before) if before else None
+		reverse = values is not None
+		if not reverse:
+			values = decode_cursor(after) if after else None
+		if values is not None and len(values) != len(self.ordering):
+			values, reverse = None, False
+		# one more row is fetched to know if there's another page
+		items = self.fetch(values, reverse, self.per_page + 1)
+		more = len(items) > self.per_page
+		items = items[:self.per_page]
+		if reverse:
+			items.reverse()
+			has_next, has_previous = True, more
+		else:
+			has_next, has_previous = more, values is not None
+		next_query = previous_query = None
+		if has_next and items:
+			next_query = self.get_query(query, 'after', encode_cursor(self.get_values(items[-1])))
+		if has_previous and items:
+			previous_query = self.get_query(query, 'before', encode_cursor(self.get_values(items[0])))
+		elif has_previous:
+			previous_query = self.get_query(query)
+		return KeysetPage(items, self, next_query, previous_query, self.get_query(query))
+
+	def get_query(self, query, key=None, cursor=None):
+		query = query.copy() if query is not None else QueryDict(mutable=True)
+		for name in ('after', 'before', 'page'):
+			query.pop(name, None)
+		if key is not None:
+			query[key] = cursor
+		return query.urlencode()
+
+
+def paginate(request, object_list, ordering, per_page=20):
+	"""
+	Page of results requested by ``after`` or ``before`` parameters of request.
+	"""
+	paginator = KeysetPaginator(object_list, ordering, per_page)
+	return paginator.page(request.GET.get('after'), request.GET.get('before'), request.GET)
@@ -0,0 +1,189 @@
+from django.db import transaction, IntegrityError
+from django.db.models import F
+
+from quaero.models import Site, Page, Link, Image, ImageDetail, get_image_search_vector
+
+
+def get_sites(site_urls):
+	"""
+	:return: dictionary of site url to :class:`Site`, missing sites are created
+	"""
+	site_urls = set(site_urls)
+	sites = {site.site_url: site for site in Site.objects.filter(site_url__in=site_urls)}
+	missing = [Site(site_url=site_url) for site_url in site_urls if site_url not in sites]
+	if missing:
+		try:
+			with transaction.atomic():
+				Site.objects.bulk_create(missing)
+		except IntegrityError:
+			# some of sites are created by another crawler, so create the rest one by one
+			missing = [Site.objects.get_or_create(site_url=site.site_url)[0] for site in missing]
+		sites.update({site.site_url: site for site in missing})
+	return sites
+
+
+def get_pages(sites, keys):
+	"""
+	:param sites: dictionary of site url to :class:`Site`
+	:param keys: (site url, path, scheme) of pages
+	:return: dictionary of (site url, path) to :class:`Page`, missing pages are created
+	"""
+	schemes = {(site_url, path): scheme for site_url, path, scheme in keys}
+	pages = {}
+	existing = Page.objects.filter(
+		site__in=[sites[site_url] for site_url, path in schemes], path__in={path for site_url, path in schemes}
+	).only('pk', 'site', 'path', 'scheme')
+	site_urls = {site.pk: site.site_url for site in sites.values()}
+	for page in existing:
+		key = (site_urls[page.site_id], page.path)
+		if key in schemes and key not in pages:
+			page.site = sites[key[0]]
+			pages[key] = page
+	missing = [
+		Page(site=sites[site_url], path=path, scheme=scheme)
+		for (site_url, path), scheme in schemes.items() if (site_url, path) not in pages
+	]
+	if missing:
+		try:
+			with transaction.atomic():
+				Page.objects.bulk_create(missing)
+		except IntegrityError:
+			# some of pages are created by another crawler, so create the rest one by one
+			missing = [
+				Page.objects.get_or_create(site=page.site, path=page.path, defaults={'scheme': page.scheme})[0]
+				for page in missing
+			]
+			for page in missing:
+				page.site = sites[page.site.site_url]
+		pages.update({(page.site.site_url, page.path): page for page in missing})
+	return pages
+
+
+def get_images(sites, keys):
+	"""
+	:param sites: dictionary of site url to :class:`Site`
+	:param keys: (site url, path) of images
+	:return: dictionary of (site url, path) to :class:`Image`, missing images are created
+	"""
+	keys = set(keys)
+	images = {}
+	existing = Image.objects.filter(
+		site__in=[sites[site_url] for site_url, path in keys], path__in={path for site_url, path in keys}
+	)
+	site_urls = {site.pk: site.site_url for site in sites.values()}
+	for image in existing:
+		key = (site_urls[image.site_id], image.path)
+		if key in keys:
+			image.site = sites[key[0]]
+			images[key] = image
+	missing = [Image(site=sites[site_url], path=path) for site_url, path in keys if (site_url, path) not in images]
+	if missing:
+		try:
+			with transaction.atomic():
+				Image.objects.bulk_create(missing)
+		except IntegrityError:
+			# some of images are created by another crawler, so create the rest one by one
+			missing = [Image.objects.get_or_create(site=image.site, path=image.path)[0] for image in missing]
+		images.update({(image.site.site_url, image.path): image for image in missing})
+	return images
+
+
+class ImageBuffer(object):
+	"""
+	Write-behind buffer of images found in a page, they are written in bulk by ``flush()``
+	and images that are removed from the page are deleted from it's details.
+	"""
+	def __init__(self, page):
+		self.page = page
+		self.images = {}  # (site url, path) -> (title, alt)
+
+	def add(self, site_url, path, title=None, alt=None):
+		self.images[(site_url, path)] = (title, alt)
+
+	def __len__(self):
+		return len(self.images)
+
+	def flush(self):
+		with transaction.atomic():
+			sites = get_sites(site_url for site_url, path in self.images)
+			images = get_images(sites, self.images.keys())
+
+			existing = {detail.image_id: detail for detail in ImageDetail.objects.filter(page=self.page)}
+			new_details = []
+			found = set()
+			for key, (title, alt) in self.images.items():
+				image = images[key]
+				found.add(image.pk)
+				detail = existing.get(image.pk)
+				if detail is None:
+					new_details.append(ImageDetail(image=image, page=self.page, title=title, alt=alt))
+				elif (detail.title, detail.alt) != (title, alt):
+					detail.title = title
+					detail.alt = alt
+					detail.save(update_fields=['title', 'alt'])
+			ImageDetail.objects.bulk_create(new_details)
+			removed = [detail.pk for image_id, detail in existing.items() if image_id not in found]
+			if removed:
+				ImageDetail.objects.filter(pk__in=removed).delete()
+			if self.images:
+				ImageDetail.objects.filter(page=self.page).update(search_vector=get_image_search_vector(self.page))
+		self.images = {}
+
+
+class LinkBuffer(object):
+	"""
+	Write-behind buffer of links found in a page.
+	Links are accumulated with ``add()``, then their sites, pages and the links are written with
+	a few bulk queries in one transaction by ``flush()``. Links that are removed from the page are deleted.
+	Backlinks of linked pages are counted in the same transaction.
+	"""
+	def __init__(self, page):
+		self.page = page
+		self.links = {}  # (site url, path) -> link attributes
+
+	def add(self, site_url, path, scheme="http", title=None, text=None, rel=None):
+		self.links[(site_url, path)] = {
+			'scheme': scheme,
+			'title': title[:1024] if title else title,
+			'text': text[:1024] if text else text,
+			'rel': rel[:1024] if rel else rel,
+		}
+
+	def __len__(self):
+		return len(self.links)
+
+	def flush(self):
+		with transaction.atomic():
+			sites = get_sites(site_url for site_url, path in self.links)
+			pages = get_pages(sites, [(site_url, path, link['scheme']) for (site_url, path), link in self.links.items()])
+
+			existing = {link.to_url_id: link for link in Link.objects.filter(from_url=self.page)}
+			new_links = []
+			found = set()
+			for key, attributes in self.links.items():
+				to_url = pages[key]
+				found.add(to_url.pk)
+				link = existing.get(to_url.pk)
+				if link is None:
+					new_links.append(Link(
+						from_url=self.page, to_url=to_url,
+						title=attributes['title'], text=attributes['text'], rel=attributes['rel'],
+					))
+				elif (link.title, link.text, link.rel) != (attributes['title'], attributes['text'], attributes['rel']):
+					# update link's rel and title
+					link.title = attributes['title']
+					link.text = attributes['text']
+					link.rel = attributes['rel']
+					link.save(update_fields=['title', 'text', 'rel'])
+			Link.objects.bulk_create(new_links)
+			# links which are removed during page edit
+			removed = [link for to_url_id, link in existing.items() if to_url_id not in found]
+			if removed:
+				Link.objects.filter(pk__in=[link.pk for link in removed]).delete()
+			# a page links to another page once, so backlinks of all linked pages change by one
+			if new_links:
+				Page.objects.filter(pk__in=[link.to_url_id for link in new_links]).update(backlinks=F('backlinks') + 1)
+			if removed:
+				Page.objects.filter(pk__in=[link.to_url_id for link in removed], backlinks__gt=0)\
+					.update(backlinks=F('backlinks') - 1)
+		self.links = {}
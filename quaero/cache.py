@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import OrderedDict
+from hashlib import md5
+
+from django.core.cache import caches
+
+from project import settings
+
+
+class SearchCache(object):
+	"""
+	Cache of search results, keyed by normalized query, search type and result page.
+	Results are kept in an in-process LRU, and in a shared django cache if SEARCH_CACHE_SHARED is set,
+	both for SEARCH_CACHE_TIMEOUT seconds.
+	Keys contain generation counters of searched data, which are bumped when crawler stores pages,
+	so results cached before a change are never read again and are evicted by LRU or timeout.
+	Generation counters are kept in SEARCH_CACHE_SHARED cache, or django's default cache, so it must be
+	a cache shared between processes(e.g. memcached) when crawler and web server are different processes,
+	otherwise results of other processes' crawls are found after SEARCH_CACHE_TIMEOUT.
+	"""
+	def __init__(self, size=None, shared=None, timeout=None):
+		self.size = settings.SEARCH_CACHE_SIZE if size is None else size
+		self.shared = settings.SEARCH_CACHE_SHARED if shared is None else shared
+		self.timeout = timeout or settings.SEARCH_CACHE_TIMEOUT
+		self.results = OrderedDict()  # key -> (expiry time, results)
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+
+	def get_cache(self):
+		return caches[self.shared or 'default']
+
+	def get_generation(self, name):
+		cache = self.get_cache()
+		key = "search-generation:{}".format(name)
+		generation = cache.get(key)
+		if generation is None:
+			# counters start from current time, so an evicted counter doesn't repeat a previous generation
+			cache.add(key, int(time.time() * 1000), timeout=None)
+			generation = cache.get(key, 0)
+		return generation
+
+	def bump(self, *names):
+		"""
+		Invalidate cached results of searches over given data, e.g. "pages" or "images".
+		"""
+		cache = self.get_cache()
+		for name in names:
+			key = "search-generation:{}".format(name)
+			try:
+				cache.incr(key)
+			except ValueError:
+				cache.add(key, int(time.time() * 1000), timeout=None)
+
+	def get_key(self, search_type, query, page, generations):
+		"""
+		:param page: cursor or number of result page
+		:param generations: names of generation counters of searched data
+		"""
+		query = " ".join((query or "").lower().split())
+		versions = ",".join(str(self.get_generation(name)) for name in generations)
+		return "search:{}:{}:{}:{}".format(versions, search_type, md5(query.encode('utf-8')).hexdigest(), page or "")
+
+	def get(self, key):
+		with self.lock:
+			expires, results = self.results.get(key, (None, None))
+			if results is not None:
+				if expires > time.time():
+					self.results.move_to_end(key)
+				else:
+					del self.results[key]
+					results = None
+		if results is None and self.shared:
+			results = caches[self.shared].get(key)
+			if results is not None:
+				self.set_local(key, results)
+		if results is None:
+			self.misses += 1
+		else:
+			self.hits += 1
+		return results
+
+	def set(self, key, results):
+		self.set_local(key, results)
+		if self.shared:
+			caches[self.shared].set(key, results, self.timeout)
+
+	def set_local(self, key, results):
+		if not self.size:
+			return
+		with self.lock:
+			self.results[key] = (time.time() + self.timeout, results)
+			self.results.move_to_end(key)
+			if len(self.results) > self.size:
+				self.results.popitem(last=False)
+
+	def clear(self):
+		with self.lock:
+			self.results.clear()
+
+
+search_cache = SearchCache()
@@ -1,14 +1,32 @@
+import time
 from urllib.parse import urlparse, urljoin
-from quaero.models import Site, Page, Link
+from project import settings
+from quaero.models import Site, Page
+from quaero.buffer import LinkBuffer
+from quaero.cache import search_cache
+from quaero.fetcher import Fetcher
+from quaero.index import get_index
+from quaero.frontier import Frontier
+from quaero.scheduler import PolitenessScheduler
+from quaero.visited import get_visited_set
 from quaero.functions import get_site_path
 
 
 class Crawler(object):
-	def __init__(self, url, depth, external=False):
+	def __init__(self, url, depth, external=False, resume=False, fetcher=None, visited_mode=None, start=True):
+		"""
+		:param start: crawl right away, otherwise urls are crawled by calling ``start()`` and ``run()``
+			or by celery workers, see :mod:`quaero.tasks`
+		"""
 		parse = urlparse(url)
 		self.url = url
 		self.depth = depth
 		self.external = external
+		# pages of each batch are fetched concurrently, while each site is rate limited by scheduler
+		self.fetcher = fetcher or Fetcher()
+		if self.fetcher.scheduler is None:
+			self.fetcher.scheduler = PolitenessScheduler()
+		self.scheduler = self.fetcher.scheduler
 
 		self.site = parse.netloc
 		# remove "/" at the end of site's url
@@ -16,46 +34,167 @@ class Crawler(object):
 			self.site = self.site[:-1]
 
 		self.sites = {}
-		self.urls = []
+		self.robots_sites = {}  # sites of current batch which their robots.txt should be fetched
+		# urls seen in this crawl, it's a bloom filter for huge crawls
+		self.visited = get_visited_set(visited_mode)
 		self.links = 0
 		self.followed = 0
-		self.crawl(url, self.depth)
 
-	def enqueue(self, url):
-		pass
+		# urls waiting to be crawled are stored in database, so an interrupted crawl can be resumed
+		self.frontier = Frontier(crawl=url)
+		if start:
+			self.start(resume)
+			self.run()
 
-	def crawl(self, link_url, depth=1):
-		site_url, path = get_site_path(link_url)
-		# Create or find site
-		if site_url in self.sites:
-			site = self.sites[site_url]
+	def start(self, resume=False):
+		# queue seed url, or requeue urls of an interrupted crawl
+		if resume:
+			self.frontier.reset()
 		else:
+			self.frontier.clear()
+		self.visited.add(self.url)
+		self.enqueue(self.url, self.depth)
+
+	@property
+	def visited_hits(self):
+		return self.visited.hits
+
+	@property
+	def visited_misses(self):
+		return self.visited.misses
+
+	def enqueue(self, url, depth):
+		return self.frontier.push(url, depth)
+
+	def run(self):
+		# crawl queued urls batch by batch until frontier is empty
+		while True:
+			items = self.frontier.pop()
+			if not items:
+				# failed urls are waited for, urls of blocked sites are left to a resumed crawl
+				wait = self.frontier.get_retry_wait()
+				if wait is None:
+					break
+				time.sleep(wait)
+				continue
+			self.crawl_batch(items)
+
+	def get_site(self, site_url):
+		# Create or find site
+		site = self.sites.get(site_url)
+		if site is None:
 			try:
 				site = Site.objects.get(site_url=site_url)
 			except Site.DoesNotExist:
 				site = Site(site_url=site_url)
-				# Site already exists, so just update it's robots.txt file
-				site.update_robot()
 				site.save()
+			self.scheduler.set_delay(site_url, site.get_crawl_delay())
 			self.sites[site_url] = site
-		# Create or find page
-		try:
-			page = Page.objects.get(site=site, path=path)
-		except Page.DoesNotExist:
-			page = Page(site=site, path=path)
-			page.save()
+		# block time is over, so site can be crawled again
+		if site.status == 'B' and not site.is_blocked():
+			site.status = 'A'
+			site.blocked_until = None
+			site.save()
+		if site.robots_expired():
+			self.robots_sites[site_url] = site
+		return site
+
+	def get_page(self, url):
+		site_url, path = get_site_path(url)
+		site = self.get_site(site_url)
+		# Create or find page, it may be created by another crawler meanwhile
+		page = Page.objects.get_or_create(site=site, path=path)[0]
+		page.site = site
+		return page
+
+	def crawl_batch(self, items):
+		"""
+		Fetch and scrap frontier items concurrently.
+		:return: list of scrapped pages
+		"""
+		pages = [self.get_page(item.url) for item in items]
+
+		# robots.txt of new sites, or the ones that are expired, are fetched concurrently before their pages
+		robots = self.fetcher.fetch_all(site.get_robots_url() for site in self.robots_sites.values())
+		for site in self.robots_sites.values():
+			site.update_robot(robots[site.get_robots_url()])
+			self.scheduler.set_delay(site.site_url, site.get_crawl_delay())
+		self.robots_sites = {}
+
+		# pages crawled before are requested conditionally, with validators of their last crawl
+		fetched = [page for page in pages if not self.is_blocked(page.site) and page.is_allowed()]
+		responses = self.fetcher.fetch_all(
+			(page.get_url() for page in fetched), {page.get_url(): page.get_validators() for page in fetched}
+		)
+
+		# mark sites that kept responding with 429/503 as temporarily blocked
+		for site_url in list(self.scheduler.blocked):
+			site = self.sites.get(site_url)
+			if site is not None and site.status == 'A':
+				site.block()
+
+		scrapped = []
+		for item, page in zip(items, pages):
+			url = page.get_url()
+			if self.is_blocked(page.site):
+				print("Site is blocked: {}".format(url))
+				if page.site.status == 'S':
+					self.frontier.fail(item)
+				else:
+					# it's crawled when block time of site is over, it's not a failed attempt
+					self.frontier.postpone(item, page.site.blocked_until)
+				continue
+			try:
+				parsed = self.crawl(page, item.depth, responses.get(url, False))
+			except Exception as e:
+				print("Crawling failed: {}\n{}".format(item.url, e))
+				self.frontier.fail(item)
+			else:
+				if parsed is None:
+					# page couldn't be retrieved, e.g. timeout or connection error
+					self.frontier.fail(item)
+					continue
+				self.followed += 1
+				self.frontier.done(item)
+				# unchanged pages are not indexed again
+				if parsed and parsed is not True:
+					scrapped.append(page)
+		# pages of a batch are added to inverted index as one segment
+		if scrapped and settings.SEARCH_BACKEND == "index":
+			get_index().update((page.pk, page.page_title, page.article_content) for page in scrapped)
+		if scrapped:
+			search_cache.bump("pages", "images")
+		return scrapped
+
+	def is_blocked(self, site):
+		return self.scheduler.is_blocked(site.site_url) or site.is_blocked()
+
+	def crawl(self, page, depth=1, response=None):
+		"""
+		:param response: fetched page, False if page is not allowed to be fetched
+		:return: :class:`quaero.parser.ParsedPage` of the page, True if it's not changed, or False/None if it's not scrapped
+		"""
+		if response is None:
+			print("Retrieval failed: {}".format(page.get_url()))
+			return None
+		if response is False:
+			print("Retrieval is not allowed by robots.txt: {}".format(page.get_url()))
+			return False
 		# Scrap for content and links
-		soup = page.scrap()
+		parsed = page.scrap(response)
+		if parsed is True:
+			# links of an unchanged page are the ones stored in last crawl
+			if depth > 1:
+				self.follow_stored_links(page, depth)
+			return parsed
 		# Quit if we reached maximum depth, and we are allowed to scrap the page
-		if depth > 1 and soup is not False:
-			# list all links's pk in this page, so we can remove the ones that are removed in page edits
-			existing_links = []
+		if depth > 1 and parsed is not False:
+			# links are buffered and written in bulk, and new urls are queued together
+			links = LinkBuffer(page)
+			queue = []
 			# find and store all links
-			for link in soup.find_all('a'):
-				link_url = link.get('href')
-				link_title = link.get("title")
-				link_rel = link.get('rel')
-				link_content = link.contents[0]
+			for href, link_title, link_rel, link_content in parsed.links:
+				link_url = href
 
 				# try to get site url and path
 				link_parse = urlparse(link_url)
@@ -84,39 +223,32 @@ class Crawler(object):
 				#  if link_path[0:1] is not "/":
 				#  	link_path = "/{}".format(link_path)
 
-				# if it's not an external link or externals can be crawled,
-				# and it's not already crawled using this crawl task then crawl them
-				if (link_site_url == self.site or self.external is True) and link_url not in self.urls:
-					self.links += 1
-					self.urls.append(link_url)
-					# create ore find a link between this page and link's reference page
-					try:
-						link = Link.objects.get(to_url__site__site_url=link_site_url, to_url__page__path=link_path, from_url=page)
-					except:
-						target_site = Site.objects.get_or_create(site_url=link_site_url)[0]
-						target_page = Page.objects.get_or_create(path=link_path, site=target_site)[0]
-						link = Link.objects.get_or_create(from_url=page, to_url=target_page)[0]
-					# update link's rel and title
-					if link.title is not link_title or link.rel is not link_rel:
-						link.title = link_title
-						link.rel = link_rel
-						link.text = link_content
-						link.save()
-					# creating a list of existing links on page, later links which are removed during page edit will be removed
-					existing_links.append(link.pk)
-					# crawl if link's relationship is is not marked as "no follow"
-					nofollow = False
-					if link_rel is not None and isinstance(link_rel, list):
-						for rel in link_rel:
-							if rel.lower().find("nofollow") != -1:
-								nofollow = True
-					if nofollow is False:
-						crawl_url = link.to_url.get_url()
-						print("Crawling: {}\ndepth: {}\nrel: {}".format(crawl_url, depth, link_rel))
-						self.crawl(crawl_url, depth-1)
+				# if it's not an external link or externals can be crawled then store the link
+				if link_site_url == self.site or self.external is True:
+					if link_rel is not None:
+						link_rel = " ".join(link_rel)
+					links.add(link_site_url, link_path, link_parse.scheme, link_title, link_content, link_rel)
+					# crawl if link's relationship is is not marked as "no follow",
+					# and it's not already crawled using this crawl task
+					nofollow = link_rel is not None and link_rel.lower().find("nofollow") != -1
+					if nofollow is False and self.visited.add(link_url):
+						self.links += 1
+						queue.append(link_url)
 				else:
-					print("didn't proceed with scrapping: {}", link.get('href'))
-			# delete * from Link if from_url!=url
-			Link.objects.exclude(pk__in=existing_links).delete()
-		pass
+					print("didn't proceed with scrapping: {}".format(href))
+			links.flush()
+			self.frontier.push_many(queue, depth-1)
+			print("Queued {} links of {}\ndepth: {}".format(len(queue), page.get_url(), depth-1))
+		return parsed
 
+	def follow_stored_links(self, page, depth):
+		queue = []
+		for link_url, link_rel in page.get_stored_links():
+			if get_site_path(link_url)[0] != self.site and self.external is not True:
+				continue
+			nofollow = link_rel is not None and link_rel.lower().find("nofollow") != -1
+			if nofollow is False and self.visited.add(link_url):
+				self.links += 1
+				queue.append(link_url)
+		self.frontier.push_many(queue, depth-1)
+		print("Queued {} stored links of {}\ndepth: {}".format(len(queue), page.get_url(), depth-1))
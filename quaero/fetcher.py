@@ -0,0 +1,145 @@
+import asyncio
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from project import settings
+
+
+# transport independent http response, headers is a case insensitive dictionary
+Response = namedtuple('Response', ['url', 'status_code', 'headers', 'text'])
+
+
+class RequestsTransport(object):
+	"""
+	Fetch urls using ``requests`` in a thread pool, so many blocking requests can be awaited at once.
+	"""
+	# timeouts, connection errors, too many redirects, invalid urls and broken content encodings
+	errors = (requests.RequestException,)
+
+	def __init__(self, max_workers=None, timeout=None):
+		self.executor = ThreadPoolExecutor(max_workers=max_workers or settings.CRAWL_CONCURRENCY)
+		self.timeout = timeout or settings.CRAWL_TIMEOUT
+
+	async def get(self, url, headers):
+		loop = asyncio.get_event_loop()
+		try:
+			response = await loop.run_in_executor(
+				self.executor, partial(requests.get, url, headers=headers, timeout=self.timeout)
+			)
+		except self.errors:
+			return None
+		return Response(url, response.status_code, response.headers, response.text)
+
+
+class LocalTransport(object):
+	"""
+	In-memory stand-in for http, used in tests.
+	:param pages: dictionary of url to html text, :class:`Response` or (status_code, headers, text) tuple.
+		Urls that are not in dictionary get a 404 response, and requests with page's ETag in If-None-Match get a 304.
+	:param delay: seconds each request takes, used to test concurrency
+	"""
+	def __init__(self, pages=None, delay=0):
+		self.pages = pages or {}
+		self.delay = delay
+		self.requests = []  # (url, headers) of every request in order
+		self.active = 0
+		self.max_active = 0  # maximum number of requests in flight at the same time
+
+	async def get(self, url, headers):
+		self.requests.append((url, headers))
+		self.active += 1
+		self.max_active = max(self.max_active, self.active)
+		try:
+			await asyncio.sleep(self.delay)
+		finally:
+			self.active -= 1
+
+		page = self.pages.get(url)
+		if page is None:
+			return Response(url, 404, CaseInsensitiveDict(), "")
+		if isinstance(page, Response):
+			return page
+		if isinstance(page, str):
+			return Response(url, 200, CaseInsensitiveDict({'content-type': 'text/html'}), page)
+		status_code, page_headers, text = page
+		page_headers = CaseInsensitiveDict(page_headers)
+		if 'etag' in page_headers and headers.get('If-None-Match') == page_headers['etag']:
+			return Response(url, 304, page_headers, "")
+		return Response(url, status_code, page_headers, text)
+
+
+class Fetcher(object):
+	"""
+	Asyncio based fetcher, keeps up to ``concurrency`` requests in flight.
+	If a :class:`quaero.scheduler.PolitenessScheduler` is given, requests to each site are rate limited by it.
+	"""
+	def __init__(self, concurrency=None, transport=None, scheduler=None):
+		self.concurrency = concurrency or settings.CRAWL_CONCURRENCY
+		self.transport = transport or RequestsTransport(max_workers=self.concurrency)
+		self.scheduler = scheduler
+
+	def get_headers(self, url, headers=None):
+		"""
+		:param headers: extra headers of the request, e.g. validators of a conditional request
+		"""
+		result = {'User-Agent': settings.USER_AGENT}
+		if headers:
+			result.update(headers)
+		return result
+
+	async def fetch(self, url, semaphore, headers=None):
+		# wait for site's turn before taking a slot, so other sites can use it meanwhile
+		if self.scheduler is not None and not await self.scheduler.wait(url):
+			return None
+		async with semaphore:
+			response = await self.transport.get(url, self.get_headers(url, headers))
+		if self.scheduler is not None:
+			self.scheduler.record(url, response)
+		return response
+
+	async def fetch_many(self, urls, headers):
+		semaphore = asyncio.Semaphore(self.concurrency)
+		responses = await asyncio.gather(
+			*[self.fetch(url, semaphore, headers.get(url)) for url in urls], return_exceptions=True
+		)
+		# an error of a url doesn't fail other urls of the batch, it's not retrieved
+		for url, response in zip(urls, responses):
+			if isinstance(response, Exception):
+				print("Fetching failed: {}\n{}".format(url, response))
+		return [None if isinstance(response, Exception) else response for response in responses]
+
+	def fetch_all(self, urls, headers=None):
+		"""
+		Fetch urls concurrently.
+		:param headers: dictionary of url to it's extra request headers
+		:return: dictionary of url to :class:`Response`, or None if url couldn't be retrieved
+		"""
+		urls = list(urls)
+		if not urls:
+			return {}
+		loop = asyncio.new_event_loop()
+		try:
+			responses = loop.run_until_complete(self.fetch_many(urls, headers or {}))
+		finally:
+			loop.close()
+		return dict(zip(urls, responses))
+
+	def fetch_one(self, url, headers=None):
+		return self.fetch_all([url], {url: headers})[url]
+
+
+default_fetcher = None
+
+
+def get_fetcher():
+	"""
+	Shared fetcher, used when a page or robots.txt is fetched outside of a crawl.
+	"""
+	global default_fetcher
+	if default_fetcher is None:
+		default_fetcher = Fetcher()
+	return default_fetcher
@@ -0,0 +1,111 @@
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.db import transaction, IntegrityError
+from django.db.models import F, Q, Min
+from django.utils import timezone
+
+from project import settings
+from quaero.models import FrontierUrl
+
+
+class Frontier(object):
+	"""
+	Persistent queue of urls waiting to be crawled.
+	Urls are stored in :class:`FrontierUrl` rows, so a crawl can be paused and resumed after a crash,
+	and only one batch of urls is loaded in memory at a time regardless of site's size.
+	Urls with more remaining depth are popped first, which makes the crawl breadth-first.
+	Urls which couldn't be crawled are popped again after their ``retry_after`` time.
+	"""
+	def __init__(self, crawl, batch_size=None):
+		"""
+		:param crawl: key of the crawl task, usually it's seed url
+		:param batch_size: number of urls returned by each ``pop()``
+		"""
+		self.crawl = crawl
+		self.batch_size = batch_size or settings.CRAWL_BATCH_SIZE
+
+	def queryset(self):
+		return FrontierUrl.objects.filter(crawl=self.crawl)
+
+	def push(self, url, depth):
+		"""
+		Add a url to the frontier if it's not already queued or crawled in this crawl task.
+		:return: True if url is added
+		"""
+		return FrontierUrl.objects.get_or_create(crawl=self.crawl, url=url, defaults={'depth': depth})[1]
+
+	def push_many(self, urls, depth):
+		"""
+		Add urls that are not already in frontier with two queries.
+		:return: number of added urls
+		"""
+		urls = list(OrderedDict.fromkeys(urls))
+		existing = set(self.queryset().filter(url__in=urls).values_list('url', flat=True))
+		items = [FrontierUrl(crawl=self.crawl, url=url, depth=depth) for url in urls if url not in existing]
+		try:
+			with transaction.atomic():
+				FrontierUrl.objects.bulk_create(items)
+		except IntegrityError:
+			# some of urls are queued by another crawler meanwhile
+			return sum(self.push(item.url, depth) for item in items)
+		return len(items)
+
+	def pop(self):
+		"""
+		Reserve next batch of queued urls, shallow urls(bigger remaining depth) first.
+		:return: list of :class:`FrontierUrl`, empty if there is nothing to crawl now
+		"""
+		with transaction.atomic():
+			items = list(
+				self.queryset().filter(Q(retry_after__isnull=True) | Q(retry_after__lte=timezone.now()), status='Q')
+				.order_by('-depth', 'pk')
+				.select_for_update(skip_locked=True)[:self.batch_size]
+			)
+			FrontierUrl.objects.filter(pk__in=[item.pk for item in items]).update(status='C')
+		return items
+
+	def done(self, item):
+		FrontierUrl.objects.filter(pk=item.pk).update(status='D')
+
+	def fail(self, item):
+		"""
+		Queue a url which couldn't be crawled again, it's marked as failed after CRAWL_RETRIES retries.
+		Retries are CRAWL_RETRY_DELAY seconds apart, doubled after each one.
+		:return: True if url is queued again
+		"""
+		retry_after = timezone.now() + timedelta(seconds=settings.CRAWL_RETRY_DELAY * 2 ** item.attempts)
+		retried = FrontierUrl.objects.filter(pk=item.pk, attempts__lt=settings.CRAWL_RETRIES)\
+			.update(status='Q', attempts=F('attempts') + 1, retry_after=retry_after)
+		if not retried:
+			FrontierUrl.objects.filter(pk=item.pk).update(status='F')
+		return bool(retried)
+
+	def postpone(self, item, retry_after):
+		"""
+		Queue a url again without counting it as a failed attempt, e.g. when it's site is temporarily blocked.
+		"""
+		FrontierUrl.objects.filter(pk=item.pk).update(status='Q', retry_after=retry_after)
+
+	def get_retry_wait(self):
+		"""
+		Urls postponed longer than a retry, e.g. urls of blocked sites, are left to a resumed crawl.
+		:return: seconds until a failed url can be retried, None if no url is waiting for a retry
+		"""
+		retry_after = self.queryset().filter(status='Q').aggregate(retry_after=Min('retry_after'))['retry_after']
+		if retry_after is None:
+			return None
+		wait = max((retry_after - timezone.now()).total_seconds(), 0)
+		return wait if wait <= settings.CRAWL_RETRY_DELAY * 2 ** settings.CRAWL_RETRIES else None
+
+	def reset(self):
+		"""
+		Requeue urls that were reserved by an interrupted crawl, so they'll be crawled on resume.
+		"""
+		return self.queryset().filter(status='C').update(status='Q')
+
+	def clear(self):
+		return self.queryset().delete()
+
+	def __len__(self):
+		return self.queryset().filter(status='Q').count()
@@ -0,0 +1,831 @@
+"""
+Inverted index of pages, searched with BM25 without touching Page table until results are shown.
+An index is a directory of immutable segment files. Each segment maps terms to posting lists of
+(document, term frequency, positions), compressed with variable length integers, and is memory mapped
+so only posting lists of searched terms are read from disk. Deleted documents of a segment are kept
+in a separate bitmap file, until the segment is merged.
+"""
+import fcntl
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+from array import array
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+
+from project import settings
+
+
+MAGIC = b'QIX2'
+HEADER = struct.Struct('<4sIIQQQQ')  # magic, doc count, term count, total length, docs, dictionary and postings offsets
+SKIP = struct.Struct('<II')  # last document before a block of postings, and offset of the block
+SKIP_INTERVAL = 128  # number of postings in a block, blocks are skipped while searching
+PRIORS_HEADER = struct.Struct('<Q')
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def get_deletions_path(segment_path):
+	return segment_path[:-len(".seg")] + ".del"
+
+
+def tokenize(text):
+	return TOKEN_RE.findall(text.lower()) if text else []
+
+
+def encode_varint(value, buffer):
+	while value >= 0x80:
+		buffer.append((value & 0x7f) | 0x80)
+		value >>= 7
+	buffer.append(value)
+
+
+def decode_varint(data, offset):
+	"""
+	:return: (value, offset of next byte)
+	"""
+	value = 0
+	shift = 0
+	while True:
+		byte = data[offset]
+		offset += 1
+		value |= (byte & 0x7f) << shift
+		if byte < 0x80:
+			return value, offset
+		shift += 7
+
+
+class SegmentWriter(object):
+	"""
+	Collects documents in memory and writes them as a segment file.
+	"""
+	def __init__(self):
+		self.page_ids = []
+		self.lengths = []
+		self.postings = defaultdict(list)  # term -> [(doc, positions)]
+
+	def __len__(self):
+		return len(self.page_ids)
+
+	@classmethod
+	def merge(cls, segments, deletions):
+		"""
+		Writer of live documents of segments, documents are renumbered in order of segments.
+		:param deletions: deletion bitmap of each segment
+		"""
+		writer = cls()
+		doc_maps = []
+		for segment, deleted in zip(segments, deletions):
+			doc_map = {}
+			for doc in range(segment.doc_count):
+				if not deleted[doc >> 3] & (1 << (doc & 7)):
+					doc_map[doc] = len(writer.page_ids)
+					writer.page_ids.append(segment.page_ids[doc])
+					writer.lengths.append(segment.lengths[doc])
+			doc_maps.append(doc_map)
+		for segment, doc_map in zip(segments, doc_maps):
+			for term in segment.terms:
+				for doc, tf, positions in segment.postings(term, positions=True):
+					if doc in doc_map:
+						writer.postings[term].append((doc_map[doc], positions))
+		return writer
+
+	def add(self, page_id, title, content):
+		doc = len(self.page_ids)
+		terms = defaultdict(list)
+		for position, term in enumerate(tokenize(title) + tokenize(content)):
+			terms[term].append(position)
+		for term, positions in terms.items():
+			self.postings[term].append((doc, positions))
+		self.page_ids.append(page_id)
+		self.lengths.append(sum(len(positions) for positions in terms.values()))
+
+	def write(self, path):
+		dictionary = bytearray()
+		postings = bytearray()
+		for term in sorted(self.postings):
+			start = len(postings)
+			last_doc = 0
+			skips = bytearray()
+			for i, (doc, positions) in enumerate(self.postings[term]):
+				if i and i % SKIP_INTERVAL == 0:
+					skips += SKIP.pack(last_doc, len(postings) - start)
+				# doc and positions are delta encoded, positions are prefixed by their byte size so they can be skipped
+				encoded = bytearray()
+				last_position = 0
+				for position in positions:
+					encode_varint(position - last_position, encoded)
+					last_position = position
+				encode_varint(doc - last_doc, postings)
+				encode_varint(len(positions), postings)
+				encode_varint(len(encoded), postings)
+				postings += encoded
+				last_doc = doc
+			length = len(postings) - start
+			# skip table of a term follows it's postings
+			postings += skips
+			term_bytes = term.encode('utf-8')
+			encode_varint(len(term_bytes), dictionary)
+			dictionary += term_bytes
+			encode_varint(len(self.postings[term]), dictionary)
+			encode_varint(start, dictionary)
+			encode_varint(length, dictionary)
+			# highest term frequency and shortest document of a term bound it's score while searching
+			encode_varint(max(len(positions) for doc, positions in self.postings[term]), dictionary)
+			encode_varint(min(self.lengths[doc] for doc, positions in self.postings[term]), dictionary)
+
+		docs = struct.pack('<{}q'.format(len(self.page_ids)), *self.page_ids) + \
+			struct.pack('<{}I'.format(len(self.lengths)), *self.lengths)
+		docs_offset = HEADER.size
+		dictionary_offset = docs_offset + len(docs)
+		postings_offset = dictionary_offset + len(dictionary)
+		# segment is written to a temporary file and renamed, so readers never see a partial segment
+		with open(path + ".tmp", 'wb') as f:
+			f.write(HEADER.pack(
+				MAGIC, len(self.page_ids), len(self.postings), sum(self.lengths), docs_offset, dictionary_offset, postings_offset
+			))
+			f.write(docs)
+			f.write(dictionary)
+			f.write(postings)
+		os.replace(path + ".tmp", path)
+
+
+class Segment(object):
+	"""
+	Read only, memory mapped segment file. Term dictionary is loaded in memory, posting lists are read on demand.
+	"""
+	def __init__(self, path):
+		self.path = path
+		self.name = os.path.basename(path)
+		with open(path, 'rb') as f:
+			self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		magic, self.doc_count, term_count, self.total_length, docs_offset, dictionary_offset, self.postings_offset = \
+			HEADER.unpack_from(self.data, 0)
+		if magic != MAGIC:
+			raise ValueError("{} is not an index segment".format(path))
+		view = memoryview(self.data)
+		self.page_ids = view[docs_offset:docs_offset + 8 * self.doc_count].cast('q')
+		self.lengths = view[docs_offset + 8 * self.doc_count:dictionary_offset].cast('I')
+
+		self.terms = {}  # term -> (document frequency, offset, size, highest term frequency, shortest document)
+		offset = dictionary_offset
+		for i in range(term_count):
+			size, offset = decode_varint(self.data, offset)
+			term = self.data[offset:offset + size].decode('utf-8')
+			offset += size
+			df, offset = decode_varint(self.data, offset)
+			start, offset = decode_varint(self.data, offset)
+			length, offset = decode_varint(self.data, offset)
+			max_tf, offset = decode_varint(self.data, offset)
+			min_length, offset = decode_varint(self.data, offset)
+			self.terms[term] = (df, start, length, max_tf, min_length)
+		self.priors = None  # static score of documents, see Index.refresh_priors()
+		self.max_prior = 0.0
+
+		self.doc_map = None
+		self.deleted = bytearray((self.doc_count + 7) // 8)  # bitmap of documents which are deleted or updated later
+		self.live_count = self.doc_count
+		self.live_length = self.total_length
+
+	def __len__(self):
+		return self.doc_count
+
+	def load_deletions(self):
+		try:
+			with open(get_deletions_path(self.path), 'rb') as f:
+				deleted = bytearray(f.read())
+		except FileNotFoundError:
+			deleted = bytearray((self.doc_count + 7) // 8)
+		docs = [doc for doc in range(self.doc_count) if deleted[doc >> 3] & (1 << (doc & 7))] if any(deleted) else []
+		self.live_count = self.doc_count - len(docs)
+		self.live_length = self.total_length - sum(self.lengths[doc] for doc in docs)
+		self.deleted = deleted
+
+	def write_deletions(self):
+		path = get_deletions_path(self.path)
+		with open(path + ".tmp", 'wb') as f:
+			f.write(self.deleted)
+		os.replace(path + ".tmp", path)
+
+	def is_deleted(self, doc):
+		return bool(self.deleted[doc >> 3] & (1 << (doc & 7)))
+
+	def delete(self, doc):
+		self.deleted[doc >> 3] |= 1 << (doc & 7)
+		self.live_count -= 1
+		self.live_length -= self.lengths[doc]
+
+	def get_doc(self, page_id):
+		"""
+		:return: document number of a page in this segment, None if it's not in the segment
+		"""
+		if self.doc_map is None:
+			self.doc_map = dict((page_id, doc) for doc, page_id in enumerate(self.page_ids))
+		return self.doc_map.get(page_id)
+
+	def close(self):
+		self.page_ids.release()
+		self.lengths.release()
+		self.data.close()
+
+	def doc_freq(self, term):
+		return self.terms[term][0] if term in self.terms else 0
+
+	def postings(self, term, positions=False):
+		"""
+		Yield (doc, term frequency) of documents containing the term, or (doc, tf, positions) if ``positions`` is set.
+		"""
+		if term not in self.terms:
+			return
+		df, start, length = self.terms[term][:3]
+		data = self.data
+		offset = self.postings_offset + start
+		doc = 0
+		for i in range(df):
+			delta, offset = decode_varint(data, offset)
+			tf, offset = decode_varint(data, offset)
+			size, offset = decode_varint(data, offset)
+			doc += delta
+			if positions:
+				decoded = []
+				end = offset + size
+				position = 0
+				while offset < end:
+					delta, offset = decode_varint(data, offset)
+					position += delta
+					decoded.append(position)
+				yield doc, tf, decoded
+			else:
+				offset += size
+				yield doc, tf
+
+
+class PostingCursor(object):
+	"""
+	Posting list of a term in a segment, read one document at a time. ``seek()`` jumps over
+	blocks of postings using skip table of the term, without decoding them.
+	"""
+	END = 1 << 32
+
+	def __init__(self, segment, term):
+		self.data = segment.data
+		df, start, length, self.max_tf, self.min_length = segment.terms[term]
+		self.base = segment.postings_offset + start
+		self.skips = self.base + length
+		self.skip_count = (df - 1) // SKIP_INTERVAL
+		self.offset = self.base
+		self.remaining = df
+		self.position = 0  # number of postings read
+		self.doc = -1
+		self.tf = 0
+		self.next()
+
+	def next(self):
+		if not self.remaining:
+			self.doc = self.END
+			return
+		data = self.data
+		delta, offset = decode_varint(data, self.offset)
+		self.tf, offset = decode_varint(data, offset)
+		size, offset = decode_varint(data, offset)
+		self.doc = delta if self.doc < 0 else self.doc + delta
+		self.offset = offset + size
+		self.remaining -= 1
+		self.position += 1
+
+	def seek(self, target):
+		"""
+		Move to first document which is not before target.
+		"""
+		if self.doc >= target:
+			return
+		# find last block which starts before target
+		low, high = self.position // SKIP_INTERVAL, self.skip_count
+		while low < high:
+			middle = (low + high + 1) // 2
+			if SKIP.unpack_from(self.data, self.skips + (middle - 1) * SKIP.size)[0] < target:
+				low = middle
+			else:
+				high = middle - 1
+		if low > (self.position - 1) // SKIP_INTERVAL:
+			self.doc, offset = SKIP.unpack_from(self.data, self.skips + (low - 1) * SKIP.size)
+			self.offset = self.base + offset
+			self.remaining += self.position - low * SKIP_INTERVAL
+			self.position = low * SKIP_INTERVAL
+		while self.doc < target:
+			self.next()
+
+
+class Index(object):
+	"""
+	Directory of segments searched together. Term statistics are summed over segments, so scores
+	don't depend on how documents are split between segments.
+
+	Index is updated like a log structured merge tree, new and changed pages are written as a small segment and
+	their older versions are marked in deletion bitmaps of older segments. Segments of similar size are merged
+	in background, so number of segments, and query latency, grows logarithmically with number of pages.
+	Live segments are listed in a manifest file, which is replaced atomically, so readers always see a
+	consistent set of segments. Writers of all processes are serialized by a file lock.
+	"""
+	def __init__(self, path=None, k1=None, b=None):
+		self.path = path or settings.SEARCH_INDEX_DIR
+		self.k1 = settings.SEARCH_BM25_K1 if k1 is None else k1
+		self.b = settings.SEARCH_BM25_B if b is None else b
+		self.segments = []
+		self.manifest = {'counter': 0, 'segments': []}
+		self.manifest_stat = None
+		self.priors_stat = None
+		self.prior_page_ids = np.zeros(0, dtype=np.int64)  # sorted ids of pages, and their priors
+		self.prior_values = np.zeros(0, dtype=np.float32)
+		self.thread_lock = threading.RLock()
+		self.merge_thread = None
+		self.refresh()
+
+	@property
+	def manifest_path(self):
+		return os.path.join(self.path, "segments.json")
+
+	def read_manifest(self):
+		try:
+			with open(self.manifest_path) as f:
+				return json.load(f)
+		except FileNotFoundError:
+			return {'counter': 0, 'segments': []}
+
+	def write_manifest(self):
+		with open(self.manifest_path + ".tmp", 'w') as f:
+			json.dump(self.manifest, f)
+		os.replace(self.manifest_path + ".tmp", self.manifest_path)
+		self.refresh()
+
+	def refresh(self):
+		"""
+		Open new segments and reload deletions and priors, if they are changed by this or another process.
+		"""
+		with self.thread_lock:
+			self.refresh_segments()
+			self.refresh_priors()
+
+	def refresh_segments(self):
+		with self.thread_lock:
+			while True:
+				try:
+					stat = os.stat(self.manifest_path)
+					key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+				except FileNotFoundError:
+					key = None
+				if key == self.manifest_stat:
+					return
+				manifest = self.read_manifest()
+				opened = dict((segment.name, segment) for segment in self.segments)
+				try:
+					segments = [opened.get(name) or Segment(os.path.join(self.path, name)) for name in manifest['segments']]
+				except FileNotFoundError:
+					continue  # segments are merged by another process meanwhile, read the new manifest
+				for segment in segments:
+					segment.load_deletions()
+				# segments dropped from manifest are not closed, they may be still used by a running search
+				self.manifest, self.segments, self.manifest_stat = manifest, segments, key
+
+	@property
+	def priors_path(self):
+		return os.path.join(self.path, "priors.bin")
+
+	def write_priors(self, rows):
+		"""
+		Store static score of pages, which is added to their text relevance.
+		:param rows: iterable of (page id, rank, backlinks)
+		"""
+		page_ids = array('q')
+		priors = array('f')
+		for page_id, rank, backlinks in rows:
+			page_ids.append(page_id)
+			priors.append(get_prior(rank, backlinks))
+		page_ids = np.frombuffer(page_ids, dtype=np.int64)
+		order = np.argsort(page_ids, kind='mergesort')
+		os.makedirs(self.path, exist_ok=True)
+		with open(self.priors_path + ".tmp", 'wb') as f:
+			f.write(PRIORS_HEADER.pack(len(page_ids)))
+			f.write(page_ids[order].tobytes())
+			f.write(np.frombuffer(priors, dtype=np.float32)[order].tobytes())
+		os.replace(self.priors_path + ".tmp", self.priors_path)
+		self.refresh()
+
+	def refresh_priors(self):
+		try:
+			stat = os.stat(self.priors_path)
+			key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+		except FileNotFoundError:
+			key = None
+		if key != self.priors_stat:
+			self.prior_page_ids = np.zeros(0, dtype=np.int64)
+			self.prior_values = np.zeros(0, dtype=np.float32)
+			if key is not None:
+				with open(self.priors_path, 'rb') as f:
+					count, = PRIORS_HEADER.unpack(f.read(PRIORS_HEADER.size))
+					self.prior_page_ids = np.fromfile(f, dtype=np.int64, count=count)
+					self.prior_values = np.fromfile(f, dtype=np.float32, count=count)
+			self.priors_stat = key
+			for segment in self.segments:
+				segment.priors = None
+		for segment in self.segments:
+			if segment.priors is None:
+				# priors are aligned with documents of segment, so they are looked up by document number
+				values = np.zeros(segment.doc_count, dtype=np.float32)
+				if len(self.prior_page_ids) and segment.doc_count:
+					page_ids = np.array(segment.page_ids, dtype=np.int64)
+					positions = np.minimum(np.searchsorted(self.prior_page_ids, page_ids), len(self.prior_page_ids) - 1)
+					found = self.prior_page_ids[positions] == page_ids
+					values[found] = self.prior_values[positions[found]]
+				segment.max_prior = float(values.max()) if segment.doc_count else 0.0
+				segment.priors = array('f', values.tobytes())
+
+	@contextmanager
+	def lock(self):
+		os.makedirs(self.path, exist_ok=True)
+		with self.thread_lock, open(os.path.join(self.path, "lock"), 'w') as f:
+			fcntl.flock(f, fcntl.LOCK_EX)
+			try:
+				self.refresh()
+				yield
+			finally:
+				fcntl.flock(f, fcntl.LOCK_UN)
+
+	def allocate_name(self):
+		# it must be called while index is locked, and manifest written afterwards
+		self.manifest['counter'] += 1
+		return "{:08d}.seg".format(self.manifest['counter'])
+
+	def remove_segment(self, name):
+		for path in (os.path.join(self.path, name), get_deletions_path(os.path.join(self.path, name))):
+			if os.path.exists(path):
+				os.remove(path)
+
+	def close(self):
+		if self.merge_thread is not None:
+			self.merge_thread.join()
+		for segment in self.segments:
+			segment.close()
+		self.segments = []
+		self.manifest_stat = None
+
+	def __len__(self):
+		return sum(segment.live_count for segment in self.segments)
+
+	def build(self, documents, segment_size=None):
+		"""
+		Replace index with given documents.
+		:param documents: iterable of (page id, title, content)
+		:param segment_size: maximum number of documents of a segment
+		"""
+		segment_size = segment_size or settings.SEARCH_INDEX_SEGMENT_SIZE
+		with self.lock():
+			old = self.manifest['segments']
+			names = []
+			writer = SegmentWriter()
+			for page_id, title, content in documents:
+				writer.add(page_id, title, content)
+				if len(writer) >= segment_size:
+					names.append(self.allocate_name())
+					writer.write(os.path.join(self.path, names[-1]))
+					writer = SegmentWriter()
+			if len(writer):
+				names.append(self.allocate_name())
+				writer.write(os.path.join(self.path, names[-1]))
+			self.manifest['segments'] = names
+			self.write_manifest()
+			for name in old:
+				self.remove_segment(name)
+
+	def update(self, documents):
+		"""
+		Add new or changed pages as a new segment, older versions of the pages are marked as deleted.
+		:param documents: iterable of (page id, title, content)
+		"""
+		# pages are tokenized before taking the lock, so other writers aren't blocked by it
+		writer = SegmentWriter()
+		for page_id, title, content in documents:
+			writer.add(page_id, title, content)
+		if not len(writer):
+			return
+		with self.lock():
+			name = self.allocate_name()
+			writer.write(os.path.join(self.path, name))
+			self.mark_deleted(writer.page_ids)
+			self.manifest['segments'].append(name)
+			self.write_manifest()
+		self.maybe_merge()
+
+	def delete(self, page_ids):
+		with self.lock():
+			self.mark_deleted(page_ids)
+			self.write_manifest()
+
+	def mark_deleted(self, page_ids):
+		for segment in self.segments:
+			changed = False
+			for page_id in page_ids:
+				doc = segment.get_doc(page_id)
+				if doc is not None and not segment.is_deleted(doc):
+					segment.delete(doc)
+					changed = True
+			if changed:
+				segment.write_deletions()
+
+	def get_merge(self):
+		"""
+		Tiered merge policy, segments are grouped by order of magnitude of their size and
+		SEARCH_INDEX_MERGE_FACTOR segments of a tier are merged together. Segments with
+		more deleted than live documents are rewritten to reclaim space.
+		:return: list of segments to merge, empty if there's nothing to merge
+		"""
+		factor = settings.SEARCH_INDEX_MERGE_FACTOR
+		tiers = defaultdict(list)
+		for segment in self.segments:
+			if segment.live_count < settings.SEARCH_INDEX_SEGMENT_SIZE:
+				tiers[int(math.log(max(segment.live_count, 1), factor))].append(segment)
+		for tier in sorted(tiers):
+			if len(tiers[tier]) >= factor:
+				return tiers[tier][:factor]
+		for segment in self.segments:
+			if segment.doc_count - segment.live_count > segment.doc_count / 2:
+				return [segment]
+		return []
+
+	def merge(self, segments):
+		"""
+		Write live documents of segments into a new segment, and replace them in manifest.
+		:return: False if segments are already merged by another process
+		"""
+		with self.lock():
+			name = self.allocate_name()
+			self.write_manifest()
+		# documents deleted until now are dropped, the ones deleted during merge are applied to the new segment
+		deletions = [bytes(segment.deleted) for segment in segments]
+		path = os.path.join(self.path, name)
+		SegmentWriter.merge(segments, deletions).write(path)
+
+		names = [segment.name for segment in segments]
+		with self.lock():
+			if not all(name in self.manifest['segments'] for name in names):
+				os.remove(path)
+				return False
+			merged = Segment(path)
+			current = dict((segment.name, segment) for segment in self.segments)
+			for segment, deleted in zip(segments, deletions):
+				segment = current[segment.name]
+				for doc in range(segment.doc_count):
+					if segment.is_deleted(doc) and not deleted[doc >> 3] & (1 << (doc & 7)):
+						merged.delete(merged.get_doc(segment.page_ids[doc]))
+			if merged.live_count < merged.doc_count:
+				merged.write_deletions()
+			merged.close()
+			position = self.manifest['segments'].index(names[0])
+			self.manifest['segments'] = [segment for segment in self.manifest['segments'] if segment not in names]
+			self.manifest['segments'].insert(position, name)
+			self.write_manifest()
+			for segment in names:
+				self.remove_segment(segment)
+		return True
+
+	def merge_all(self):
+		# merge until merge policy is satisfied
+		while True:
+			with self.thread_lock:
+				self.refresh()
+				segments = self.get_merge()
+			if not segments or not self.merge(segments):
+				return
+
+	def maybe_merge(self, background=None):
+		"""
+		:param background: merge in a background thread, default is SEARCH_INDEX_BACKGROUND_MERGE setting
+		"""
+		background = settings.SEARCH_INDEX_BACKGROUND_MERGE if background is None else background
+		if not background:
+			self.merge_all()
+			return
+		with self.thread_lock:
+			if self.merge_thread is None or not self.merge_thread.is_alive():
+				self.merge_thread = threading.Thread(target=self.merge_all, daemon=True)
+				self.merge_thread.start()
+
+	def get_statistics(self, segments, terms):
+		"""
+		Document frequencies include deleted documents until their segment is merged.
+		:return: (average document length, dict of term -> idf) of terms which exist in index
+		"""
+		doc_count = sum(segment.live_count for segment in segments)
+		if not doc_count:
+			return 0, {}
+		idfs = {}
+		for term in set(terms):
+			df = sum(segment.doc_freq(term) for segment in segments)
+			if df:
+				idfs[term] = math.log(1 + max(doc_count - df + 0.5, 0) / (df + 0.5))
+		return sum(segment.live_length for segment in segments) / doc_count, idfs
+
+	def bm25(self, idf, tf, length, average_length):
+		return idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / average_length))
+
+	def get_score(self, parts):
+		"""
+		Score of a document from it's prior and BM25 of it's terms. They're summed with ``math.fsum``, which doesn't
+		depend on their order, so a document has exactly the same score in ``score()`` and ``top()``, however
+		it's posting lists are read. Cursors of result pages are compared with these scores.
+		"""
+		return math.fsum(parts)
+
+	def score(self, terms):
+		"""
+		Score of every live document containing any of the terms, it's BM25 plus document's prior.
+		:return: dict of page id -> score
+		"""
+		self.refresh()
+		segments = self.segments
+		average_length, idfs = self.get_statistics(segments, terms)
+		scores = {}
+		for segment in segments:
+			lengths = segment.lengths
+			deleted = segment.deleted if segment.live_count < segment.doc_count else None
+			segment_parts = defaultdict(list)
+			for term, idf in idfs.items():
+				for doc, tf in segment.postings(term):
+					if deleted is None or not deleted[doc >> 3] & (1 << (doc & 7)):
+						segment_parts[doc].append(self.bm25(idf, tf, lengths[doc], average_length))
+			for doc, parts in segment_parts.items():
+				parts.append(segment.priors[doc])
+				scores[segment.page_ids[doc]] = self.get_score(parts)
+		return scores
+
+	def search(self, query, k=20):
+		"""
+		Score all matched documents, use ``top()`` when number of matched documents isn't needed.
+		:return: number of matched documents and [(score, page id)] of top k documents, best first
+		"""
+		scores = self.score(tokenize(query))
+		return len(scores), get_top(scores, k)
+
+	def count(self, query):
+		"""
+		Approximate number of matched documents, from document frequencies of query terms.
+		It's exact for queries of one term, when there's no deleted document.
+		"""
+		self.refresh()
+		terms = set(tokenize(query))
+		return min(len(self), sum(segment.doc_freq(term) for segment in self.segments for term in terms))
+
+	def top(self, query, k=20, after=None):
+		"""
+		Top k documents of a query, with the same scores and order as ``search()``.
+		Documents are read in order from posting lists with max-score algorithm: once k documents are found,
+		posting lists which their score bound, plus highest prior, can't beat the k-th score are not iterated
+		anymore, they're only probed for documents of other lists, and blocks of them are skipped.
+		:param after: (score, page id) of a document, only documents ordered after it are returned
+		:return: [(score, page id)] best first
+		"""
+		self.refresh()
+		segments = self.segments
+		average_length, idfs = self.get_statistics(segments, tokenize(query))
+		if k <= 0 or not idfs:
+			return []
+		if after is not None:
+			after = (after[0], -after[1])
+		heap = []  # k best (score, -page id) found so far, worst one first
+		for segment in segments:
+			cursors = []
+			for term, idf in idfs.items():
+				if term in segment.terms:
+					cursor = PostingCursor(segment, term)
+					cursors.append((self.bm25(idf, cursor.max_tf, cursor.min_length, average_length), idf, cursor))
+			if not cursors:
+				continue
+			# bounds[i] is the highest score a document can get from the first i+1 lists
+			cursors.sort(key=lambda item: item[0])
+			bounds = []
+			for bound, idf, cursor in cursors:
+				bounds.append(bound + (bounds[-1] if bounds else 0))
+			lengths, page_ids, priors = segment.lengths, segment.page_ids, segment.priors
+			deleted = segment.deleted if segment.live_count < segment.doc_count else None
+			essential = 0  # lists before it are non essential
+			while True:
+				threshold = heap[0][0] if len(heap) >= k else None
+				if threshold is not None:
+					while essential < len(cursors) and bounds[essential] + segment.max_prior < threshold:
+						essential += 1
+					if essential == len(cursors):
+						break
+				doc = min(cursor.doc for bound, idf, cursor in cursors[essential:])
+				if doc == PostingCursor.END:
+					break
+				# score is a running sum for pruning, document's score is computed from parts at the end
+				score = priors[doc]
+				parts = [score]
+				for bound, idf, cursor in cursors[essential:]:
+					if cursor.doc == doc:
+						part = self.bm25(idf, cursor.tf, lengths[doc], average_length)
+						score += part
+						parts.append(part)
+						cursor.next()
+				if deleted is not None and deleted[doc >> 3] & (1 << (doc & 7)):
+					continue
+				for i in range(essential - 1, -1, -1):
+					if score + bounds[i] < threshold:
+						break
+					bound, idf, cursor = cursors[i]
+					cursor.seek(doc)
+					if cursor.doc == doc:
+						part = self.bm25(idf, cursor.tf, lengths[doc], average_length)
+						score += part
+						parts.append(part)
+				item = (self.get_score(parts), -page_ids[doc])
+				if after is not None and item >= after:
+					continue
+				if len(heap) < k:
+					heapq.heappush(heap, item)
+				elif item > heap[0]:
+					heapq.heapreplace(heap, item)
+		return [(score, -page_id) for score, page_id in sorted(heap, reverse=True)]
+
+
+def get_prior(rank, backlinks):
+	"""
+	Static score of a page, which is added to it's text relevance.
+	It's the same as :func:`quaero.models.get_prior_expression` of database search.
+	"""
+	return settings.SEARCH_RANK_WEIGHT * math.log1p(rank or 0) + settings.SEARCH_BACKLINKS_WEIGHT * math.log1p(backlinks or 0)
+
+
+def get_top(scores, k):
+	# heap keeps k best documents, instead of sorting every matched document
+	top = heapq.nlargest(k, ((score, -page_id) for page_id, score in scores.items()))
+	return [(score, -page_id) for score, page_id in top]
+
+
+class SearchResults(object):
+	"""
+	Lazy sequence of pages matching a query, for ``Paginator`` or keyset pagination by ``fetch()``.
+	Only documents which can be in the requested page are scored, and only pages of it are loaded from database.
+	Count of results is approximate.
+	"""
+	def __init__(self, index, query, queryset):
+		self.index = index
+		self.query = query
+		self.queryset = queryset
+		self._count = None
+
+	def count(self):
+		if self._count is None:
+			self._count = self.index.count(self.query)
+		return self._count
+
+	def __len__(self):
+		return self.count()
+
+	def __getitem__(self, item):
+		if not isinstance(item, slice):
+			return self[item:item + 1][0]
+		start = item.start or 0
+		stop = self.count() if item.stop is None else item.stop
+		return self.get_pages(self.index.top(self.query, stop)[start:])
+
+	def fetch(self, values, reverse, limit):
+		"""
+		Pages ordered by ``-search_rank, pk`` which are after values, or before them if ``reverse`` is set.
+		"""
+		if not reverse:
+			return self.get_pages(self.index.top(self.query, limit, after=values))
+		# pages of previous result pages aren't found by max-score, so all matched documents are scored,
+		# their scores are the same as top()'s, see Index.get_score()
+		cursor = (values[0], -values[1])
+		scores = self.index.score(tokenize(self.query))
+		before = sorted(item for item in ((score, -page_id) for page_id, score in scores.items()) if item > cursor)
+		return self.get_pages([(score, -page_id) for score, page_id in before[:limit]])
+
+	def get_pages(self, top):
+		pages = self.queryset.in_bulk([page_id for score, page_id in top])
+		results = []
+		for score, page_id in top:
+			if page_id in pages:
+				pages[page_id].search_rank = score
+				results.append(pages[page_id])
+		return results
+
+
+default_index = None
+
+
+def get_index():
+	"""
+	Shared index of a process, segments are mapped once and reused by requests.
+	"""
+	global default_index
+	if default_index is None:
+		default_index = Index()
+	return default_index
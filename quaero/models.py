@@ -1,22 +1,32 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Func, Value, TextField, FloatField, ExpressionWrapper
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.postgres.fields import ArrayField, HStoreField, JSONField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 
-import io
-from urllib.parse import urlparse
-from urllib.robotparser import RobotFileParser
-from newspaper import Article
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import timedelta
+from urllib.parse import urlparse, urljoin
 
 from project import settings
-import requests
-from bs4 import BeautifulSoup
+from quaero.fetcher import get_fetcher
 from quaero.functions import get_site_path
+from quaero.nlp import summarize, process_inline
+from quaero.parser import ParsedPage
+from quaero.robots import robots_cache
 
 
 class Site(models.Model):
 	site_url = models.CharField(_('Site Url'), max_length=1024, db_index=True, unique=True, blank=False)
 	robots = models.CharField(max_length=4096, blank=True, null=True)  # content of robots.txt read by update_robot()
 	robots_status = models.PositiveSmallIntegerField(blank=True, null=True)  # content of robots.txt read by update_robot()
+	robots_updated = models.DateTimeField(_('robots.txt updated'), blank=True, null=True)  # robots.txt is fetched again after ROBOTS_TTL
 	created = models.DateTimeField(_('first searched'), auto_now_add=True, blank=True, null=True)
 	last_crawled = models.DateTimeField(_('last crawled'), auto_now=True, blank=True, null=True)
 	status = models.CharField(max_length=1, default='A', choices=(
@@ -24,22 +34,30 @@ class Site(models.Model):
 		('B', "Temporarily Blocked"),
 		('S', "Spam site"),
 	))
+	blocked_until = models.DateTimeField(blank=True, null=True)  # end of temporary block, set by block()
 
 	meta = JSONField(blank=True, null=True)
 
 	def __str__(self):
 		return self.site_url
 
-	def update_robot(self):
-		url = "{}/robots.txt".format( self.get_url() )
-		try:
-			response = requests.get(url, headers={'User-Agent': settings.USER_AGENT})
-		except (requests.ConnectTimeout, requests.HTTPError, requests.ReadTimeout, requests.Timeout, requests.ConnectionError):
+	def update_robot(self, response=None):
+		"""
+		:param response: robots.txt response if it's already fetched(e.g. by crawler), otherwise it's fetched here
+		"""
+		if response is None:
+			response = get_fetcher().fetch_one(self.get_robots_url())
+		if response is None:
 			return
 		if response.status_code == 200:
 			self.robots = response.text
 		self.robots_status = response.status_code
+		self.robots_updated = timezone.now()
 		self.save()
+		robots_cache.invalidate(self)
+
+	def robots_expired(self):
+		return self.robots_updated is None or self.robots_updated + timedelta(seconds=settings.ROBOTS_TTL) < timezone.now()
 
 	def get_url(self):
 		parse = urlparse(self.site_url)
@@ -48,6 +66,163 @@ class Site(models.Model):
 
 		return parse.scheme + "://" + parse.netloc
 
+	def get_robots_url(self):
+		return "{}/robots.txt".format(self.get_url())
+
+	def get_crawl_delay(self):
+		"""
+		:return: seconds between requests asked by robots.txt's Crawl-delay, None if it's not set
+		"""
+		parser = robots_cache.get(self)
+		if parser is not None:
+			return parser.crawl_delay(settings.USER_AGENT)
+		return None
+
+	def is_blocked(self):
+		# temporarily blocked sites are crawled again after CRAWL_BLOCK_TIME seconds
+		if self.status == 'B':
+			return self.blocked_until is None or self.blocked_until > timezone.now()
+		return self.status == 'S'
+
+	def block(self):
+		self.status = 'B'
+		self.blocked_until = timezone.now() + timedelta(seconds=settings.CRAWL_BLOCK_TIME)
+		self.save()
+
+
+site_urls = OrderedDict()  # site id -> site url, urls of sites don't change so they're kept once they're looked up
+site_urls_lock = threading.Lock()
+
+
+def get_site_url(instance):
+	"""
+	Url of a page's or image's site, from it's loaded site(e.g. by select_related) or from urls of sites which are
+	looked up before, so urls of many pages of a site are rendered without querying their site one by one.
+	"""
+	site = getattr(instance, instance._meta.get_field('site').get_cache_name(), None)
+	if site is not None:
+		return site.site_url
+	with site_urls_lock:
+		site_url = site_urls.get(instance.site_id)
+		if site_url is not None:
+			# least recently used urls are evicted
+			site_urls.move_to_end(instance.site_id)
+			return site_url
+	site_url = Site.objects.filter(pk=instance.site_id).values_list('site_url', flat=True).get()
+	with site_urls_lock:
+		site_urls[instance.site_id] = site_url
+		if len(site_urls) > settings.SITE_URL_CACHE_SIZE:
+			site_urls.popitem(last=False)
+	return site_url
+
+
+def get_search_vector():
+	"""
+	Weighted text search document of a page, titles are more relevant than keywords and keywords than content.
+	"""
+	keywords = Func('article_keywords', Value(" "), function='array_to_string', output_field=TextField())
+	return (
+		SearchVector('page_title', 'article_title', weight='A', config=settings.SEARCH_CONFIG) +
+		SearchVector(keywords, weight='B', config=settings.SEARCH_CONFIG) +
+		SearchVector('article_content', weight='C', config=settings.SEARCH_CONFIG)
+	)
+
+
+def get_image_search_vector(page):
+	"""
+	Text search document of images of a page, image's title and alt are more relevant than titles of the page.
+	Page's titles are copied into documents of it's images, so images are searched without joining pages.
+	"""
+	titles = " ".join(title for title in (page.page_title, page.article_title) if title)
+	return (
+		SearchVector('title', 'alt', weight='A', config=settings.SEARCH_CONFIG) +
+		SearchVector(Value(titles, output_field=TextField()), weight='C', config=settings.SEARCH_CONFIG)
+	)
+
+
+def get_prior_expression():
+	"""
+	Static score of a page, which is added to it's text relevance. It's the same as :func:`quaero.index.get_prior`.
+	"""
+	rank = Func(Coalesce('rank', Value(0.0)) + Value(1.0), function='LN', output_field=FloatField())
+	backlinks = Func(Coalesce('backlinks', Value(0)) + Value(1.0), function='LN', output_field=FloatField())
+	return ExpressionWrapper(
+		Value(settings.SEARCH_RANK_WEIGHT) * rank + Value(settings.SEARCH_BACKLINKS_WEIGHT) * backlinks,
+		output_field=FloatField()
+	)
+
+
+class PageQuerySet(models.QuerySet):
+	# columns shown in lists of pages and search results, heavy ones like article_content aren't loaded
+	list_fields = (
+		'site', 'site__site_url', 'scheme', 'path', 'status', 'page_title', 'article_title', 'article_excerpt',
+		'rank', 'backlinks',
+	)
+
+	def listing(self):
+		"""
+		Pages with only the columns that lists show, and url of their site.
+		"""
+		return self.select_related('site').only(*self.list_fields)
+
+	def detail(self):
+		"""
+		Pages with the columns that page view shows, and their site.
+		"""
+		return self.select_related('site').defer('search_vector', 'meta', 'raw_content')
+
+
+class Blob(models.Model):
+	"""
+	Compressed content, stored once for all pages that have the same content. It's keyed by sha1 of uncompressed
+	content, which is ``Page.content_hash``, so raw html isn't stored in page rows and it's loaded only when it's used.
+	"""
+	hash = models.CharField(max_length=40, primary_key=True)
+	data = models.BinaryField()
+	size = models.PositiveIntegerField(default=0)  # bytes of uncompressed content
+	stored = models.DateTimeField(default=timezone.now, db_index=True)  # last time it's put, see clean-blobs command
+
+	@staticmethod
+	def get_hash(text):
+		return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+	@classmethod
+	def put(cls, text, content_hash=None):
+		"""
+		Store content if it's not already stored.
+		Time it's stored is renewed, so clean-blobs doesn't delete it before the page referring to it is saved.
+		:param content_hash: hash of content, if it's already computed
+		:return: hash of content
+		"""
+		data = text.encode('utf-8')
+		content_hash = content_hash or hashlib.sha1(data).hexdigest()
+		if not cls.objects.filter(pk=content_hash).update(stored=timezone.now()):
+			try:
+				with transaction.atomic():
+					cls.objects.create(hash=content_hash, data=zlib.compress(data, settings.BLOB_COMPRESSION_LEVEL), size=len(data))
+			except IntegrityError:
+				pass  # it's stored by another crawler meanwhile
+		return content_hash
+
+	@classmethod
+	def get_text(cls, content_hash):
+		"""
+		:return: content, None if it's not stored
+		"""
+		blob = cls.objects.filter(pk=content_hash).first()
+		return blob.text if blob is not None else None
+
+	@classmethod
+	def get_texts(cls, hashes):
+		"""
+		:return: dictionary of hash to content, for loading content of many pages with one query
+		"""
+		return {content_hash: blob.text for content_hash, blob in cls.objects.in_bulk(list(hashes)).items()}
+
+	@property
+	def text(self):
+		return zlib.decompress(bytes(self.data)).decode('utf-8')
+
 
 class Page(models.Model):
 	site = models.ForeignKey("Site", on_delete=models.CASCADE)
@@ -56,9 +231,20 @@ class Page(models.Model):
 
 	status = models.PositiveSmallIntegerField(blank=True, null=True)
 	created = models.DateTimeField(_('first searched'), auto_now_add=True, blank=True, null=True)
-	last_crawled = models.DateTimeField(_('last crawled'), auto_now=True, blank=True, null=True)
+	last_crawled = models.DateTimeField(_('last crawled'), blank=True, null=True)  # set when page is fetched
 	backlinks = models.BigIntegerField(blank=True, null=True, default=0)
-
+	# validators of fetched content, sent in conditional requests of next crawl
+	etag = models.CharField(max_length=1024, blank=True, null=True)
+	last_modified = models.CharField(max_length=64, blank=True, null=True)
+	content_hash = models.CharField(max_length=40, blank=True, null=True)  # sha1 of fetched content
+	# crawl history, see quaero.revisit
+	revisits = models.PositiveIntegerField(default=0)
+	changes = models.PositiveIntegerField(default=0)  # revisits which found page changed
+	revisit_time = models.FloatField(default=0)  # total seconds between crawls
+	change_rate = models.FloatField(blank=True, null=True)  # estimated changes per day
+	next_crawl = models.DateTimeField(blank=True, null=True, db_index=True)
+
+	# html of pages crawled before they were stored in Blob, it's moved to blobs by move-raw-content command
 	raw_content = models.TextField(blank=True, null=True)
 	page_title = models.CharField(max_length=2048, blank=True, null=True)
 	article_title = models.CharField(max_length=2048, blank=True, null=True)
@@ -71,28 +257,79 @@ class Page(models.Model):
 
 	rank = models.FloatField(blank=True, null=True)
 	meta = JSONField(blank=True, null=True)
+	search_vector = SearchVectorField(blank=True, null=True)  # set by update_search_vector(), after page is scrapped
+
+	objects = PageQuerySet.as_manager()
+
+	class Meta:
+		unique_together = ("site", "path")
+		indexes = [GinIndex(fields=['search_vector'])]
 
 	def __str__(self):
 		return self.get_url()
 
 	def get_url(self):
-		if self.scheme:
-			return "{}://{}{}".format(self.scheme, self.site.site_url, self.path)
-		else:
-			return "http://{}{}".format(self.site, self.path)
+		return "{}://{}{}".format(self.scheme or "http", get_site_url(self), self.path)
 
 	def get_url_address(self):
-		return "{}{}".format(self.site.site_url, self.path)
+		return "{}{}".format(get_site_url(self), self.path)
 
 	def is_allowed(self):
-		if self.site.robots_status==200:
-			parser = RobotFileParser()
-			lines = io.StringIO(self.site.robots).readlines()
-			parser.parse(lines)
+		parser = robots_cache.get(self.site)
+		if parser is not None:
 			return parser.can_fetch(settings.USER_AGENT, self.get_url())
 		return True
 
-	def scrap(self):
+	def process_nlp(self):
+		"""
+		Set article's summary and keywords
+		"""
+		self.article_excerpt, self.article_keywords = summarize(self.article_title, self.article_content)
+
+	@property
+	def html(self):
+		"""
+		Fetched html of the page, it's loaded from :class:`Blob` by ``content_hash`` when it's first used.
+		"""
+		if not hasattr(self, '_html'):
+			self._html = Blob.get_text(self.content_hash) if self.content_hash else None
+			if self._html is None:
+				self._html = self.raw_content  # it's not moved to blob store yet
+		return self._html
+
+	@html.setter
+	def html(self, text):
+		self._html = text
+
+	def get_validators(self):
+		"""
+		:return: headers of a conditional request, which is answered with 304 if page isn't modified since last crawl
+		"""
+		headers = {}
+		if self.status == 200:
+			if self.etag:
+				headers['If-None-Match'] = self.etag
+			if self.last_modified:
+				headers['If-Modified-Since'] = self.last_modified
+		return headers
+
+	def get_stored_links(self):
+		"""
+		:return: list of (url, rel) of links stored when page was scrapped
+		"""
+		links = Link.objects.filter(from_url=self).values_list('to_url__scheme', 'to_url__site__site_url', 'to_url__path', 'rel')
+		return [("{}://{}{}".format(scheme or "http", site_url, path or ""), rel) for scheme, site_url, path, rel in links]
+
+	def update_search_vector(self):
+		# it's computed by database from stored fields, so it's updated after page is saved
+		Page.objects.filter(pk=self.pk).update(search_vector=get_search_vector())
+
+	def scrap(self, response=None):
+		"""
+		:param response: page's response if it's already fetched(e.g. by crawler), otherwise it's fetched here
+		:return: :class:`quaero.parser.ParsedPage` of the page, True if it's not changed since last crawl,
+			False if it's not allowed to be fetched or it's not html, None if retrieval failed
+		"""
 		url = self.get_url()
 		print("retrieve page: {}".format(url))
 		# check if we are allowed to crawl this page
@@ -101,56 +338,109 @@ class Page(models.Model):
 			return False
 
 		# Get page content and headers
-		try:
-			response = requests.get(url, headers={'User-Agent': settings.USER_AGENT})
-		except (requests.ConnectTimeout, requests.HTTPError, requests.ReadTimeout, requests.Timeout, requests.ConnectionError):
+		if response is None:
+			response = get_fetcher().fetch_one(url, self.get_validators())
+		if response is None:
 			return
 
+		# imported here, since quaero.revisit imports Page from this module
+		from quaero.revisit import schedule
+		previous = self.last_crawled if self.content_hash or self.etag or self.last_modified else None
+		self.last_crawled = timezone.now()
+		etag = response.headers.get('etag')
+		last_modified = response.headers.get('last-modified')
+		content_hash = Blob.get_hash(response.text) if response.status_code != 304 else None
+		# content isn't parsed and stored again if server says it's not modified, or it's the same as last crawl
+		if response.status_code == 304 or (self.status == response.status_code == 200 and content_hash == self.content_hash):
+			print("Page is not modified: {}".format(url))
+			self.etag = etag or self.etag
+			self.last_modified = last_modified or self.last_modified
+			schedule(self, previous, changed=False)
+			Page.objects.filter(pk=self.pk).update(
+				last_crawled=self.last_crawled, etag=self.etag, last_modified=self.last_modified,
+				revisits=self.revisits, revisit_time=self.revisit_time, change_rate=self.change_rate, next_crawl=self.next_crawl
+			)
+			return True
+
+		schedule(self, previous, changed=True)
+		self.status = response.status_code
+		self.etag = etag
+		self.last_modified = last_modified
+		self.content_hash = content_hash
 		self.content_type = response.headers['content-type'] if 'content-type' in response.headers else ""  # usually "text/html"
 
 		# don't store page content if it's not html
-		self.raw_content = response.text
+		self.html = response.text
+		self.raw_content = None
 		if self.content_type.find("text/html") == -1:
 			print("we don't process none html pages yet.")
 			return False
 
+		# parse html page once, article, title, images and links are extracted from the same document
+		parsed = ParsedPage(url, self.html)
+
 		# store article title and content
-		article = Article(url)
-		article.set_html(self.raw_content)
-		article.parse()
-		self.article_title = article.title
-		self.article_content = article.text
-		self.article_top_image = article.top_image
-		article.nlp()
-		self.article_excerpt = article.summary
-		self.article_keywords = article.keywords
-
-		# parse html page
-		soup = BeautifulSoup(self.raw_content, "html5lib")
-
-		# Images
-		for img in soup.findAll("img"):
-			img_url = img.get('src', '')
-			img_alt = img.get('alt', '')
-			img_title = img.get('title', '')
-
-			image_site_url, image_path = get_site_path(img_url)
-			if self.site.site_url == image_site_url:
-				img_site = self.site
-			else:
-				img_site = Site.objects.get_or_create(site_url=image_site_url)[0]
-			# get image object
-			image = Image.objects.get_or_create(path=image_path, site=img_site)[0]
-			img_detail = ImageDetail.objects.get_or_create(image=image, page=self)[0]
-			img_detail.title = img_title
-			img_detail.alt = img_alt
-			img_detail.save()
+		self.article_title = parsed.article_title
+		self.article_content = parsed.article_content
+		self.article_top_image = parsed.article_top_image
+		# summary and keywords can be deferred to process-nlp command
+		self.article_excerpt = None
+		self.article_keywords = None
+		if process_inline():
+			self.process_nlp()
+
+		# Images are collected in one pass and stored in bulk
+		# imported here, since quaero.buffer imports models from this module
+		from quaero.buffer import ImageBuffer
+		images = ImageBuffer(self)
+		for img_url, img_title, img_alt in parsed.images:
+			# skip embedded images, and make relative urls absolute
+			if img_url == "" or img_url.startswith("data:"):
+				continue
+			image_site_url, image_path = get_site_path(urljoin(url, img_url))
+			images.add(image_site_url, image_path, img_title, img_alt)
 
 		# HTML Title
-		self.page_title = soup.title.string
+		self.page_title = parsed.title
+		Blob.put(self.html, self.content_hash)
 		self.save()
+		self.update_search_vector()
+		images.flush()
+
+		return parsed  # for crawling
 
-		return soup  # for crawling
+
+class FrontierUrl(models.Model):
+	crawl = models.CharField(_('Crawl'), max_length=1024, db_index=True)  # crawl task this url belongs to, it's the seed url
+	url = models.TextField(_('URL'), blank=False, null=False)
+	depth = models.PositiveSmallIntegerField(default=1)  # remaining depth, links found in this url are queued with depth-1
+	status = models.CharField(max_length=1, default='Q', choices=(
+		('Q', "Queued"),
+		('C', "Crawling"),
+		('D', "Done"),
+		('F', "Failed"),
+	))
+	attempts = models.PositiveSmallIntegerField(default=0)  # failed crawls of this url, see Frontier.fail()
+	retry_after = models.DateTimeField(blank=True, null=True)  # url isn't popped before this time
+	created = models.DateTimeField(_('queued'), auto_now_add=True, blank=True, null=True)
+
+	class Meta:
+		unique_together = ("crawl", "url")
+		index_together = ("crawl", "status", "depth")
+
+	def __str__(self):
+		return "{} ({})".format(self.url, self.depth)
+
+
+class QueryLog(models.Model):
+	"""
+	Number of times a query is searched, used for query suggestions. See :class:`quaero.suggest.QueryLogBuffer`.
+	"""
+	query = models.TextField(_('Query'), unique=True)
+	count = models.PositiveIntegerField(default=0)
+
+	def __str__(self):
+		return "{} ({})".format(self.query, self.count)
 
 
 class SiteCrawlStats(models.Model):
@@ -172,8 +462,11 @@ class Image(models.Model):
 	site = models.ForeignKey("Site", related_name="image_site")
 	path = models.TextField(_('Image Path'), blank=False, null=False)
 
+	class Meta:
+		unique_together = ("site", "path")
+
 	def get_url(self):
-		return "//{}{}".format(self.site.site_url, self.path )
+		return "//{}{}".format(get_site_url(self), self.path)
 
 	def __str__(self):
 		return self.get_url()
@@ -182,9 +475,13 @@ class Image(models.Model):
 class ImageDetail(models.Model):
 	image = models.ForeignKey("Image")
 	page = models.ForeignKey("Page")
-	unique_together = ("image", "page")
 	title = models.TextField(blank=True, null=True)
 	alt = models.TextField(blank=True, null=True)
+	search_vector = SearchVectorField(null=True)  # see get_image_search_vector
+
+	class Meta:
+		unique_together = ("image", "page")
+		indexes = [GinIndex(fields=['search_vector'])]
 
 
 class Link(models.Model):
@@ -194,15 +491,32 @@ class Link(models.Model):
 	text = models.CharField(max_length=1024, blank=True, null=True)
 	rel = models.CharField(max_length=1024, blank=True, null=True)
 
+	class Meta:
+		unique_together = ("from_url", "to_url")
+
 	def __str__(self):
 		return "{} ~ {}".format(self.from_url, self.to_url)
 
-	def add(self, from_url, to_url, title, rel):
-		pass
-		# add link
-		# add 1 to Page.backlinks
+	@classmethod
+	def add(cls, from_url, to_url, title=None, rel=None, text=None):
+		"""
+		Add or update a link, and add 1 to backlinks of linked page if it's a new link.
+		Links found while crawling are added in bulk by :class:`quaero.buffer.LinkBuffer`.
+		"""
+		with transaction.atomic():
+			link, created = cls.objects.update_or_create(
+				from_url=from_url, to_url=to_url, defaults={'title': title, 'rel': rel, 'text': text}
+			)
+			if created:
+				Page.objects.filter(pk=to_url.pk).update(backlinks=F('backlinks') + 1)
+		return link
 
 	def remove(self):
-		pass
-		# remove override
-		# remove 1 from Page.backlinks if it's bigger than 0
+		"""
+		Delete the link, and remove 1 from backlinks of linked page if it's bigger than 0.
+		"""
+		with transaction.atomic():
+			# link may be already removed, e.g. by LinkBuffer of another crawler
+			deleted, rows = Link.objects.filter(pk=self.pk).delete()
+			if deleted:
+				Page.objects.filter(pk=self.to_url_id, backlinks__gt=0).update(backlinks=F('backlinks') - 1)
@@ -0,0 +1,28 @@
+import random
+
+from newspaper import nlp as newspaper_nlp
+from newspaper.configuration import Configuration
+
+from project import settings
+
+
+def summarize(title, text):
+	"""
+	Summary and keywords of an article, it's the most cpu expensive step of processing a page.
+	:return: (summary, keywords)
+	"""
+	title = title or ""
+	text = text or ""
+	keywords = list(set(newspaper_nlp.keywords(title).keys()) | set(newspaper_nlp.keywords(text).keys()))
+	summary = "\n".join(newspaper_nlp.summarize(title=title, text=text, max_sents=Configuration().MAX_SUMMARY_SENT))
+	return summary, keywords
+
+
+def process_inline():
+	"""
+	Whether nlp should run while a page is scrapped. Otherwise page's excerpt is left empty
+	to be processed later by ``process-nlp`` command.
+	"""
+	if settings.ARTICLE_NLP != "inline":
+		return False
+	return random.random() < settings.ARTICLE_NLP_SAMPLE_RATE
@@ -0,0 +1,72 @@
+"""
+PageRank of pages over the Link graph. Graph is kept as compressed sparse rows of numpy arrays,
+so tens of millions of links fit in a few hundred megabytes, and each iteration is a few vectorized passes.
+"""
+import numpy as np
+from django.db import connection, transaction
+
+from quaero.models import Page, Link
+
+
+def load_graph(batch_size=100000):
+	"""
+	Read pages and followed links from database.
+	:return: (page ids, indptr, indices) where links of page ``page_ids[i]`` point to
+		``page_ids[indices[indptr[i]:indptr[i + 1]]]``
+	"""
+	page_ids = np.fromiter(Page.objects.order_by('pk').values_list('pk', flat=True).iterator(), dtype=np.int64)
+	sources = []
+	targets = []
+	links = Link.objects.exclude(rel__icontains="nofollow").values_list('from_url_id', 'to_url_id').iterator()
+	while True:
+		# links are converted to arrays in batches, a python tuple of each link is never kept
+		batch = np.array([link for _, link in zip(range(batch_size), links)], dtype=np.int64).reshape(-1, 2)
+		if not len(batch):
+			break
+		sources.append(np.searchsorted(page_ids, batch[:, 0]).astype(np.int32))
+		targets.append(np.searchsorted(page_ids, batch[:, 1]).astype(np.int32))
+	sources = np.concatenate(sources) if sources else np.zeros(0, dtype=np.int32)
+	targets = np.concatenate(targets) if targets else np.zeros(0, dtype=np.int32)
+
+	order = np.argsort(sources, kind='mergesort')
+	indices = targets[order]
+	indptr = np.zeros(len(page_ids) + 1, dtype=np.int64)
+	np.cumsum(np.bincount(sources, minlength=len(page_ids)), out=indptr[1:])
+	return page_ids, indptr, indices
+
+
+def pagerank(indptr, indices, damping=0.85, tolerance=1e-6, max_iterations=100):
+	"""
+	Power iteration, rank of pages without outgoing links is spread over all pages.
+	:return: (ranks which sum to 1, number of iterations)
+	"""
+	n = len(indptr) - 1
+	if n == 0:
+		return np.zeros(0), 0
+	out_degree = np.diff(indptr)
+	dangling = out_degree == 0
+	ranks = np.full(n, 1.0 / n)
+	for iteration in range(1, max_iterations + 1):
+		# each page sends rank / out degree to every page it links to
+		share = np.divide(ranks, out_degree, out=np.zeros(n), where=~dangling)
+		new_ranks = np.bincount(indices, weights=np.repeat(share, out_degree), minlength=n)
+		new_ranks = damping * (new_ranks + ranks[dangling].sum() / n) + (1 - damping) / n
+		delta = np.abs(new_ranks - ranks).sum()
+		ranks = new_ranks
+		if delta < tolerance:
+			break
+	return ranks, iteration
+
+
+def save_ranks(page_ids, ranks, batch_size=10000):
+	"""
+	Write ranks to Page.rank with one UPDATE per batch of pages.
+	"""
+	sql = "UPDATE {table} SET {rank} = r.rank FROM unnest(%s::bigint[], %s::float8[]) AS r(id, rank) WHERE {table}.{pk} = r.id".format(
+		table=connection.ops.quote_name(Page._meta.db_table),
+		rank=connection.ops.quote_name(Page._meta.get_field('rank').column),
+		pk=connection.ops.quote_name(Page._meta.pk.column),
+	)
+	with transaction.atomic(), connection.cursor() as cursor:
+		for start in range(0, len(page_ids), batch_size):
+			cursor.execute(sql, [page_ids[start:start + batch_size].tolist(), ranks[start:start + batch_size].tolist()])
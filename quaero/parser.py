@@ -0,0 +1,61 @@
+from bs4 import BeautifulSoup
+from newspaper import Article
+
+
+class ParsedPage(object):
+	"""
+	Content of an html page. Article extraction, title, images and anchors all come from a single DOM:
+	the lxml document newspaper builds while parsing the article. Only if lxml can't parse the markup,
+	page is parsed again with html5lib.
+	"""
+	def __init__(self, url, html):
+		self.url = url
+		self.article = Article(url)
+		self.article.set_html(html)
+		self.article.parse()
+
+		self.title = None
+		self.images = []  # (src, title, alt)
+		self.links = []  # (href, title, rel, text), rel is a list of values
+		if self.article.clean_doc is not None:
+			self.extract(self.article.clean_doc)
+		else:
+			self.extract_soup(BeautifulSoup(html, "html5lib"))
+
+	@property
+	def article_title(self):
+		return self.article.title
+
+	@property
+	def article_content(self):
+		return self.article.text
+
+	@property
+	def article_top_image(self):
+		return self.article.top_image
+
+	def extract(self, doc):
+		# fast path, lxml document
+		title = doc.find('.//title')
+		if title is not None:
+			self.title = title.text
+		for img in doc.iter('img'):
+			self.images.append((img.get('src', ''), img.get('title', ''), img.get('alt', '')))
+		for link in doc.iter('a'):
+			href = link.get('href')
+			if href is None:
+				continue
+			rel = link.get('rel')
+			self.links.append((href, link.get('title'), rel.split() if rel else None, link.text_content().strip()))
+
+	def extract_soup(self, soup):
+		# slow path for broken markup
+		if soup.title is not None:
+			self.title = soup.title.string
+		for img in soup.find_all('img'):
+			self.images.append((img.get('src', ''), img.get('title', ''), img.get('alt', '')))
+		for link in soup.find_all('a'):
+			href = link.get('href')
+			if href is None:
+				continue
+			self.links.append((href, link.get('title'), link.get('rel'), link.get_text().strip()))
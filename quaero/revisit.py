@@ -0,0 +1,90 @@
+"""
+Revisit scheduling of crawled pages.
+Change rate of a page is estimated from it's revisits, as changes of a Poisson process observed at revisit times,
+and a page is due again when it has probably changed(REVISIT_CHANGE_PROBABILITY) since it's last crawl.
+So a fixed number of revisits is spent on pages which change often, and stable pages are revisited rarely.
+"""
+import math
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from project import settings
+from quaero.frontier import Frontier
+from quaero.models import Page
+
+
+REVISIT_CRAWL = "revisit"  # key of revisit crawls' frontier
+
+
+def get_change_rate(revisits, changes, seconds):
+	"""
+	Estimated changes per day, from number of revisits, revisits which found a change and total seconds between them.
+	A revisit detects at most one change, so changes are estimated with -log((n - X + 0.5) / (n + 0.5)) per interval
+	instead of X / n, which underestimates rate of pages that change more than once between revisits.
+	:return: rate, None if page isn't revisited yet
+	"""
+	if not revisits or seconds <= 0:
+		return None
+	interval = seconds / revisits / (24 * 60 * 60)
+	return -math.log((revisits - changes + 0.5) / (revisits + 0.5)) / interval
+
+
+def get_revisit_interval(rate):
+	"""
+	:return: seconds until a page with given change rate has changed with REVISIT_CHANGE_PROBABILITY
+	"""
+	if rate is None:
+		return settings.REVISIT_INITIAL
+	if rate <= 0:
+		return settings.REVISIT_MAX
+	seconds = -math.log(1 - settings.REVISIT_CHANGE_PROBABILITY) / rate * 24 * 60 * 60
+	return min(max(seconds, settings.REVISIT_MIN), settings.REVISIT_MAX)
+
+
+def schedule(page, previous, changed):
+	"""
+	Record a crawl of page in it's revisit history, and set it's next crawl.
+	:param previous: time of page's previous crawl, None if it's crawled for the first time
+	:param changed: whether content of page is changed since previous crawl
+	"""
+	if previous is not None:
+		page.revisits += 1
+		page.revisit_time += max((page.last_crawled - previous).total_seconds(), 0)
+		if changed:
+			page.changes += 1
+	page.change_rate = get_change_rate(page.revisits, page.changes, page.revisit_time)
+	page.next_crawl = page.last_crawled + timedelta(seconds=get_revisit_interval(page.change_rate))
+
+
+def pop_due(budget=None):
+	"""
+	Reserve pages which are due to be revisited, the most overdue first.
+	Their next crawl is postponed by REVISIT_MIN, so a failed revisit is retried later and
+	a concurrent call doesn't get them, it's set again when they're crawled.
+	:return: list of urls
+	"""
+	now = timezone.now()
+	with transaction.atomic():
+		ids = list(
+			Page.objects.filter(next_crawl__lte=now).order_by('next_crawl').select_for_update(skip_locked=True)
+			.values_list('pk', flat=True)[:budget or settings.REVISIT_BUDGET]
+		)
+		Page.objects.filter(pk__in=ids).update(next_crawl=now + timedelta(seconds=settings.REVISIT_MIN))
+	return [page.get_url() for page in Page.objects.filter(pk__in=ids).select_related('site').order_by('pk')]
+
+
+def queue_revisits(budget=None):
+	"""
+	Queue due pages into revisit crawl's frontier, they're crawled with depth 1 by
+	``Crawler(REVISIT_CRAWL, 1, external=True, start=False).run()`` or by dispatching the crawl to workers.
+	:return: number of queued urls
+	"""
+	frontier = Frontier(crawl=REVISIT_CRAWL)
+	urls = pop_due(budget)
+	# urls of earlier revisits are removed, otherwise they wouldn't be queued again. a reserved url which is due
+	# again is left by an interrupted revisit, since pages are postponed by REVISIT_MIN when they're reserved
+	frontier.queryset().filter(status__in=['D', 'F']).delete()
+	frontier.queryset().filter(status='C', url__in=urls).delete()
+	return frontier.push_many(urls, 1)
@@ -0,0 +1,42 @@
+import io
+from collections import OrderedDict
+from urllib.robotparser import RobotFileParser
+
+from project import settings
+
+
+class RobotsCache(object):
+	"""
+	In-process LRU cache of parsed robots.txt files, keyed by site.
+	A cached parser is used as long as site's robots.txt isn't refreshed, see ``Site.update_robot()``.
+	"""
+	def __init__(self, size=None):
+		self.size = size or settings.ROBOTS_CACHE_SIZE
+		self.parsers = OrderedDict()  # site url -> (robots_updated, parser)
+
+	def get(self, site):
+		"""
+		:return: :class:`RobotFileParser` of site, None if site has no usable robots.txt
+		"""
+		entry = self.parsers.get(site.site_url)
+		if entry is not None and entry[0] == site.robots_updated:
+			self.parsers.move_to_end(site.site_url)
+			return entry[1]
+
+		parser = None
+		if site.robots_status == 200 and site.robots:
+			parser = RobotFileParser()
+			parser.parse(io.StringIO(site.robots).readlines())
+		self.parsers[site.site_url] = (site.robots_updated, parser)
+		if len(self.parsers) > self.size:
+			self.parsers.popitem(last=False)
+		return parser
+
+	def invalidate(self, site):
+		self.parsers.pop(site.site_url, None)
+
+	def clear(self):
+		self.parsers.clear()
+
+
+robots_cache = RobotsCache()
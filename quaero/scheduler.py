@@ -0,0 +1,83 @@
+import asyncio
+import time
+from urllib.parse import urlparse
+
+from project import settings
+
+
+class PolitenessScheduler(object):
+	"""
+	Keeps requests to each site apart by site's crawl delay, while requests to other sites go on.
+	Every request reserves next allowed time of it's site, so requests of a site are spread over time
+	and fetcher interleaves sites to keep overall throughput high.
+	Sites responding with 429 or 503 are backed off, and after ``block_after`` consecutive ones they are blocked
+	for ``block_time`` seconds.
+	"""
+	def __init__(self, delay=None, block_after=None, block_time=None):
+		self.delay = settings.CRAWL_DELAY if delay is None else delay
+		self.block_after = block_after or settings.CRAWL_BLOCK_AFTER
+		self.block_time = settings.CRAWL_BLOCK_TIME if block_time is None else block_time
+		self.delays = {}  # site url -> seconds between requests, e.g. robots.txt crawl-delay
+		self.next_allowed = {}  # site url -> time.monotonic() when next request is allowed
+		self.failures = {}  # site url -> consecutive 429/503 responses
+		self.blocked = set()  # site urls that should be marked as temporarily blocked
+		self.blocked_until = {}  # site url -> time.monotonic() when it's block is over
+
+	@staticmethod
+	def get_key(url):
+		return urlparse(url).netloc
+
+	def set_delay(self, site_url, delay):
+		if delay is not None:
+			self.delays[site_url] = max(float(delay), self.delay)
+
+	def get_delay(self, site_url):
+		delay = self.delays.get(site_url, self.delay)
+		# exponential back off for sites that asked us to slow down
+		return delay * 2 ** self.failures.get(site_url, 0)
+
+	def is_blocked(self, key):
+		if key in self.blocked and self.blocked_until[key] <= time.monotonic():
+			# block time is over, site is requested again
+			self.blocked.discard(key)
+			self.blocked_until.pop(key, None)
+			self.failures.pop(key, None)
+		return key in self.blocked
+
+	def reserve(self, url):
+		"""
+		Reserve next request slot of url's site.
+		:return: seconds to wait before the request, None if site is blocked
+		"""
+		key = self.get_key(url)
+		if self.is_blocked(key):
+			return None
+		now = time.monotonic()
+		allowed = max(now, self.next_allowed.get(key, now))
+		self.next_allowed[key] = allowed + self.get_delay(key)
+		return allowed - now
+
+	async def wait(self, url):
+		"""
+		:return: False if site is blocked and url shouldn't be requested
+		"""
+		delay = self.reserve(url)
+		if delay is None:
+			return False
+		if delay > 0:
+			await asyncio.sleep(delay)
+		return True
+
+	def record(self, url, response):
+		key = self.get_key(url)
+		if response is None or response.status_code not in (429, 503):
+			self.failures.pop(key, None)
+			return
+		self.failures[key] = self.failures.get(key, 0) + 1
+		retry_after = response.headers.get('retry-after', '')
+		if retry_after.isdigit():
+			self.next_allowed[key] = max(self.next_allowed.get(key, 0), time.monotonic() + int(retry_after))
+		if self.failures[key] >= self.block_after:
+			print("Too many 429/503 responses, blocking: {}".format(key))
+			self.blocked.add(key)
+			self.blocked_until[key] = time.monotonic() + self.block_time
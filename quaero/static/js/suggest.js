@@ -0,0 +1,29 @@
+// Type-ahead of search box, suggestions of typed prefix are shown in input's datalist
+$(document).ready(function() {
+	var input = $('input[data-suggest-url]');
+	var list = $('#' + input.attr('list'));
+	var timer = null;
+	var request = null;
+	var last = null;
+
+	input.on('input', function() {
+		clearTimeout(timer);
+		// wait for a pause in typing, so a request isn't sent for every key
+		timer = setTimeout(function() {
+			var query = input.val();
+			if (query === last) {
+				return;
+			}
+			last = query;
+			if (request !== null) {
+				request.abort();
+			}
+			request = $.getJSON(input.data('suggest-url'), {q: query}, function(data) {
+				list.empty();
+				$.each(data.suggestions, function(i, suggestion) {
+					list.append($('<option>').attr('value', suggestion));
+				});
+			});
+		}, 100);
+	});
+});
@@ -0,0 +1,196 @@
+"""
+Query suggestions for type-ahead of search box.
+Suggestions are phrases from article keywords, page titles and logged search queries, weighted by their frequency.
+Top phrases of each short prefix are computed when suggestions are built, so a lookup is one dictionary access,
+phrases of longer prefixes are found by binary search in sorted phrases.
+Suggestions are built periodically by ``build_suggestions`` task or build-suggestions command, into a file which
+web processes reload when it changes.
+"""
+import heapq
+import os
+import pickle
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+from django.db import connection, transaction, IntegrityError
+from django.db.models import F, Count
+from django.db.models.functions import Lower
+
+from project import settings
+from quaero.models import Page, QueryLog
+
+
+def normalize(phrase):
+	return " ".join((phrase or "").lower().split())
+
+
+class Suggester(object):
+	"""
+	:param phrases: iterable of (phrase, weight)
+	:param k: number of suggestions kept for each prefix
+	:param prefix_length: top phrases are computed for prefixes up to this length
+	"""
+	def __init__(self, phrases=(), k=None, prefix_length=None):
+		self.k = k or settings.SUGGEST_COUNT
+		self.prefix_length = prefix_length or settings.SUGGEST_PREFIX_LENGTH
+		weights = Counter()
+		for phrase, weight in phrases:
+			phrase = normalize(phrase)
+			if phrase:
+				weights[phrase] += weight
+		self.phrases = sorted(weights)
+		self.weights = [weights[phrase] for phrase in self.phrases]
+		# prefix -> indexes of it's top phrases, phrases are visited from the heaviest so each list is already ordered
+		self.top = {}
+		for i in sorted(range(len(self.phrases)), key=lambda i: -self.weights[i]):
+			phrase = self.phrases[i]
+			for length in range(1, min(len(phrase), self.prefix_length) + 1):
+				top = self.top.setdefault(phrase[:length], [])
+				if len(top) < self.k:
+					top.append(i)
+		self.top = {prefix: tuple(top) for prefix, top in self.top.items()}
+
+	def __len__(self):
+		return len(self.phrases)
+
+	def suggest(self, prefix, k=None):
+		"""
+		:return: list of top phrases starting with prefix
+		"""
+		k = min(k or self.k, self.k)
+		prefix = normalize(prefix)
+		if not prefix:
+			return []
+		if len(prefix) <= self.prefix_length:
+			top = self.top.get(prefix, ())[:k]
+		else:
+			# phrases of a long prefix are a short range of sorted phrases
+			start = bisect_left(self.phrases, prefix)
+			end = bisect_left(self.phrases, prefix + "\uffff", start)
+			top = heapq.nlargest(k, range(start, end), key=lambda i: (self.weights[i], -i))
+		return [self.phrases[i] for i in top]
+
+	def save(self, path):
+		# written to a temporary file and renamed, so readers never see a partial file
+		with open(path + ".tmp", 'wb') as f:
+			pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+		os.replace(path + ".tmp", path)
+
+	@classmethod
+	def load(cls, path):
+		with open(path, 'rb') as f:
+			return pickle.load(f)
+
+
+def get_phrases(limit=None):
+	"""
+	Phrases to suggest and their weights, which are number of pages having a keyword or title,
+	and number of times a query is searched multiplied by SUGGEST_QUERY_WEIGHT.
+	"""
+	limit = limit or settings.SUGGEST_PHRASES
+	with connection.cursor() as cursor:
+		cursor.execute(
+			"SELECT lower(keyword), count(*) FROM {}, unnest(article_keywords) AS keyword "
+			"GROUP BY 1 ORDER BY 2 DESC LIMIT %s".format(Page._meta.db_table), [limit]
+		)
+		for keyword, count in cursor.fetchall():
+			yield keyword, count
+	titles = Page.objects.filter(page_title__isnull=False).annotate(title=Lower('page_title'))\
+		.values_list('title').annotate(count=Count('pk')).order_by('-count')[:limit]
+	for title, count in titles.iterator():
+		yield title, count
+	for query, count in QueryLog.objects.order_by('-count').values_list('query', 'count')[:limit].iterator():
+		yield query, count * settings.SUGGEST_QUERY_WEIGHT
+
+
+def build_suggestions(path=None):
+	path = path or settings.SUGGEST_PATH
+	suggester = Suggester(get_phrases())
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	suggester.save(path)
+	return suggester
+
+
+class SuggestionsFile(object):
+	"""
+	Suggester loaded from SUGGEST_PATH, it's reloaded when the file is rebuilt.
+	Modification time of the file is checked at most every SUGGEST_RELOAD seconds.
+	"""
+	def __init__(self, path=None):
+		self.path = path
+		self.suggester = None
+		self.mtime = None
+		self.checked = 0
+		self.lock = threading.Lock()
+
+	def get(self):
+		now = time.time()
+		if now - self.checked >= settings.SUGGEST_RELOAD:
+			with self.lock:
+				self.checked = now
+				path = self.path or settings.SUGGEST_PATH
+				try:
+					mtime = os.path.getmtime(path)
+				except OSError:
+					mtime = None  # suggestions aren't built yet
+				if mtime != self.mtime:
+					self.suggester = Suggester.load(path) if mtime is not None else Suggester()
+					self.mtime = mtime
+		return self.suggester
+
+	def suggest(self, prefix, k=None):
+		return self.get().suggest(prefix, k)
+
+
+suggestions = SuggestionsFile()
+
+
+class QueryLogBuffer(object):
+	"""
+	Write-behind counter of searched queries, they are written to :class:`quaero.models.QueryLog`
+	every SUGGEST_LOG_FLUSH queries, so searches don't write to database.
+	"""
+	def __init__(self, size=None):
+		self.size = size or settings.SUGGEST_LOG_FLUSH
+		self.counts = Counter()
+		self.pending = 0
+		self.lock = threading.Lock()
+
+	def add(self, query):
+		query = normalize(query)
+		if not query:
+			return
+		with self.lock:
+			self.counts[query] += 1
+			self.pending += 1
+			if self.pending < self.size:
+				return
+			counts, self.counts, self.pending = self.counts, Counter(), 0
+		self.flush(counts)
+
+	def flush(self, counts=None):
+		if counts is None:
+			with self.lock:
+				counts, self.counts, self.pending = self.counts, Counter(), 0
+		with transaction.atomic():
+			existing = set(QueryLog.objects.filter(query__in=counts).values_list('query', flat=True))
+			for query in existing:
+				QueryLog.objects.filter(query=query).update(count=F('count') + counts[query])
+			missing = [QueryLog(query=query, count=count) for query, count in counts.items() if query not in existing]
+			try:
+				with transaction.atomic():
+					QueryLog.objects.bulk_create(missing)
+			except IntegrityError:
+				# some of queries are logged by another process meanwhile
+				for log in missing:
+					if not QueryLog.objects.filter(query=log.query).update(count=F('count') + log.count):
+						log.save()
+
+	def clear(self):
+		with self.lock:
+			self.counts, self.pending = Counter(), 0
+
+
+query_log = QueryLogBuffer()
@@ -0,0 +1,105 @@
+"""
+Celery tasks for distributed crawling, and periodic tasks.
+Frontier of a crawl is shared by all workers through database. ``dispatch`` pops a batch of it and sends urls of each
+site to that site's queue, so a site is always crawled by the same worker and it's politeness scheduler.
+Crawlers and politeness scheduler are kept in memory of a worker process, so workers of crawl queues must run a single
+process(``-c 1``, which is CELERY_WORKER_CONCURRENCY setting), more workers each consuming other queues crawl faster.
+Fetch, parse and persist of a page are done in one task, so page contents don't go through the broker.
+"""
+import zlib
+from collections import defaultdict
+
+from celery import shared_task
+
+from project import settings
+from quaero import suggest
+from quaero.cache import search_cache
+from quaero.crawler import Crawler
+from quaero.fetcher import Fetcher, get_fetcher
+from quaero.frontier import Frontier
+from quaero.functions import get_site_path
+from quaero.models import Page, FrontierUrl, get_search_vector
+from quaero.scheduler import PolitenessScheduler
+
+
+crawlers = {}  # (crawl, external, concurrency, visited) -> Crawler, keeps sites and visited urls of a worker between tasks
+
+
+def get_queue(site_url):
+	return "crawl-{}".format(zlib.crc32(site_url.encode('utf-8')) % settings.CRAWL_QUEUES)
+
+
+def get_crawler(crawl, external, concurrency=None, visited=None):
+	"""
+	:param concurrency: maximum number of requests in flight, default is CRAWL_CONCURRENCY setting
+	:param visited: how crawled urls are remembered, default is CRAWL_VISITED_MODE setting
+	"""
+	key = (crawl, external, concurrency, visited)
+	if key not in crawlers:
+		fetcher = get_fetcher()
+		if fetcher.scheduler is None:
+			fetcher.scheduler = PolitenessScheduler()
+		if concurrency:
+			# all crawls of a worker are rate limited by the same scheduler, so they're polite to a site together
+			fetcher = Fetcher(concurrency=concurrency, scheduler=fetcher.scheduler)
+		crawlers[key] = Crawler(
+			url=crawl, depth=None, external=external, fetcher=fetcher, visited_mode=visited, start=False
+		)
+	return crawlers[key]
+
+
+@shared_task
+def dispatch(crawl, external=False, concurrency=None, visited=None):
+	"""
+	Send next batch of crawl's frontier to workers, grouped by site.
+	Concurrency and visited mode are passed to crawlers of workers, see :func:`get_crawler`.
+	:return: number of dispatched urls
+	"""
+	frontier = Frontier(crawl=crawl)
+	items = frontier.pop()
+	if not items:
+		# failed urls are dispatched again when they can be retried
+		wait = frontier.get_retry_wait()
+		if wait is not None:
+			dispatch.apply_async(args=(crawl, external, concurrency, visited), countdown=wait)
+		return 0
+	sites = defaultdict(list)
+	for item in items:
+		sites[get_site_path(item.url)[0]].append(item.pk)
+	for site_url, item_ids in sites.items():
+		crawl_site.apply_async(args=(crawl, item_ids, external, concurrency, visited), queue=get_queue(site_url))
+	return len(items)
+
+
+@shared_task
+def crawl_site(crawl, item_ids, external=False, concurrency=None, visited=None):
+	"""
+	Fetch, parse and store frontier items of a site, then dispatch urls found meanwhile.
+	"""
+	crawler = get_crawler(crawl, external, concurrency, visited)
+	items = list(FrontierUrl.objects.filter(pk__in=item_ids).order_by('-depth', 'pk'))
+	pages = crawler.crawl_batch(items)
+	if settings.ARTICLE_NLP == "deferred" and pages:
+		process_nlp.apply_async(args=([page.pk for page in pages],), queue='nlp')
+	dispatch.delay(crawl, external, concurrency, visited)
+
+
+@shared_task
+def process_nlp(page_ids):
+	"""
+	Summarize and extract keywords of crawled pages.
+	"""
+	for page in Page.objects.filter(pk__in=page_ids).only('pk', 'article_title', 'article_content'):
+		page.process_nlp()
+		page.save(update_fields=['article_excerpt', 'article_keywords'])
+	Page.objects.filter(pk__in=page_ids).update(search_vector=get_search_vector())
+	search_cache.bump("pages")
+
+
+@shared_task
+def build_suggestions():
+	"""
+	Rebuild query suggestions from keywords, titles and logged queries, it's run by celery beat every SUGGEST_REBUILD seconds.
+	:return: number of suggested phrases
+	"""
+	return len(suggest.build_suggestions())
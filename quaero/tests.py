@@ -1,3 +1,1096 @@
-from django.test import TestCase
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import nltk
+import requests
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F, Sum
+from django.http import QueryDict
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from quaero.fetcher import Fetcher, LocalTransport, RequestsTransport
+from project import settings
+from project.celery import app as celery_app
+from project.pagination import KeysetPaginator, get_count
+from quaero import tasks
+from quaero.buffer import LinkBuffer, ImageBuffer
+from quaero.cache import search_cache
+from quaero.crawler import Crawler
+from quaero.frontier import Frontier
+from quaero.index import Index, SearchResults
+from quaero.nlp import summarize, process_inline
+from quaero.models import Site, Page, Link, Image, ImageDetail, QueryLog, Blob, site_urls
+from quaero.pagerank import load_graph, pagerank, save_ranks
+from quaero.parser import ParsedPage
+from quaero.revisit import REVISIT_CRAWL, get_change_rate, get_revisit_interval, pop_due, queue_revisits
+from quaero.robots import RobotsCache, robots_cache
+from quaero.scheduler import PolitenessScheduler
+from quaero.suggest import Suggester, SuggestionsFile, build_suggestions, query_log
+from quaero.visited import VisitedSet, BloomFilter
+
+
+class FetcherTest(SimpleTestCase):
+	def test_fetch_all(self):
+		transport = LocalTransport({
+			"http://example.com/": "<html></html>",
+			"http://example.com/moved": (301, {'location': "/"}, ""),
+		})
+		responses = Fetcher(transport=transport).fetch_all(["http://example.com/", "http://example.com/moved", "http://example.com/missing"])
+		self.assertEqual(responses["http://example.com/"].status_code, 200)
+		self.assertEqual(responses["http://example.com/moved"].headers['Location'], "/")
+		self.assertEqual(responses["http://example.com/missing"].status_code, 404)
+
+	def test_errors(self):
+		errors = {
+			"http://example.com/loop": requests.TooManyRedirects(),
+			"http://example.com/broken": requests.exceptions.ChunkedEncodingError(),
+			"http:///invalid": requests.exceptions.InvalidURL(),
+		}
+
+		def get(url, **kwargs):
+			if url in errors:
+				raise errors[url]
+			return mock.Mock(status_code=200, headers={}, text="<html></html>")
+		with mock.patch('quaero.fetcher.requests.get', get):
+			responses = Fetcher(transport=RequestsTransport(max_workers=2)).fetch_all(["http://example.com/"] + list(errors))
+		# urls that fail are not retrieved, and other urls of the batch are
+		self.assertEqual(responses["http://example.com/"].status_code, 200)
+		self.assertEqual([responses[url] for url in errors], [None] * 3)
+
+	def test_transport_error(self):
+		transport = LocalTransport({"http://example.com/": "<html></html>"})
+		get = transport.get
+
+		async def get_or_raise(url, headers):
+			if url == "http://example.com/error":
+				raise ValueError("unexpected")
+			return await get(url, headers)
+		transport.get = get_or_raise
+		responses = Fetcher(transport=transport).fetch_all(["http://example.com/", "http://example.com/error"])
+		self.assertEqual(responses["http://example.com/"].status_code, 200)
+		self.assertIsNone(responses["http://example.com/error"])
+
+	def test_concurrency_limit(self):
+		transport = LocalTransport(delay=0.01)
+		Fetcher(concurrency=5, transport=transport).fetch_all("http://example.com/{}".format(i) for i in range(20))
+		self.assertEqual(len(transport.requests), 20)
+		self.assertEqual(transport.max_active, 5)
+
+
+class PolitenessSchedulerTest(SimpleTestCase):
+	def test_reserve(self):
+		scheduler = PolitenessScheduler(delay=1)
+		scheduler.set_delay("slow.com", 5)
+		self.assertEqual(scheduler.reserve("http://example.com/a"), 0)
+		self.assertAlmostEqual(scheduler.reserve("http://example.com/b"), 1, places=2)
+		self.assertAlmostEqual(scheduler.reserve("http://example.com/c"), 2, places=2)
+		# other sites are not delayed by example.com
+		self.assertEqual(scheduler.reserve("http://slow.com/a"), 0)
+		self.assertAlmostEqual(scheduler.reserve("http://slow.com/b"), 5, places=2)
+
+	def test_block(self):
+		scheduler = PolitenessScheduler(delay=0, block_after=2)
+		transport = LocalTransport({"http://example.com/": (503, {}, "")})
+		fetcher = Fetcher(transport=transport, scheduler=scheduler)
+		fetcher.fetch_one("http://example.com/")
+		self.assertEqual(scheduler.failures["example.com"], 1)
+		fetcher.fetch_one("http://example.com/")
+		self.assertIn("example.com", scheduler.blocked)
+		# blocked sites are not requested anymore
+		self.assertIsNone(fetcher.fetch_one("http://example.com/"))
+		self.assertEqual(len(transport.requests), 2)
+		# until their block time is over
+		with mock.patch('quaero.scheduler.time.monotonic', return_value=time.monotonic() + settings.CRAWL_BLOCK_TIME + 1):
+			self.assertFalse(scheduler.is_blocked("example.com"))
+			self.assertNotIn("example.com", scheduler.failures)
+			fetcher.fetch_one("http://example.com/")
+		self.assertEqual(len(transport.requests), 3)
+
+
+class ParsedPageTest(SimpleTestCase):
+	html = """<html><head><title>Crawlers</title></head><body><h1>Web crawlers</h1><article><p>{}</p></article>
+		<img src="/crawler.png" title="Crawler" alt="A crawler"><img src="/logo.png">
+		<a href="/a" title="A"> Page A </a> <a name="top">Top</a> <a href="/b" rel="nofollow noopener">B</a>
+	</body></html>""".format("A web crawler visits pages of sites and follows their links to find more pages. " * 8)
+
+	def assertExtracted(self, page):
+		self.assertEqual(page.title, "Crawlers")
+		self.assertEqual(page.images, [("/crawler.png", "Crawler", "A crawler"), ("/logo.png", "", "")])
+		# anchors without href are skipped, rel is split into it's values
+		self.assertEqual(page.links, [("/a", "A", None, "Page A"), ("/b", None, ["nofollow", "noopener"], "B")])
+
+	def test_parse(self):
+		page = ParsedPage("http://example.com/", self.html)
+		self.assertIsNotNone(page.article.clean_doc)
+		self.assertExtracted(page)
+		self.assertEqual(page.article_title, "Crawlers")
+		self.assertTrue(page.article_content.startswith("A web crawler visits pages"))
+
+	def test_malformed(self):
+		# lxml can't parse a document starting with a null character, it's parsed again with html5lib
+		page = ParsedPage("http://example.com/", "\x00" + self.html)
+		self.assertIsNone(page.article.clean_doc)
+		self.assertExtracted(page)
+
+
+class RobotsCacheTest(SimpleTestCase):
+	def setUp(self):
+		robots_cache.clear()
+		self.site = Site(
+			site_url="example.com", robots_status=200, robots_updated=timezone.now(),
+			robots="User-agent: *\nDisallow: /private\nCrawl-delay: 3\n",
+		)
+
+	def test_is_allowed(self):
+		self.assertFalse(Page(site=self.site, path="/private/page").is_allowed())
+		self.assertTrue(Page(site=self.site, path="/public/page").is_allowed())
+		self.assertEqual(self.site.get_crawl_delay(), 3)
+
+	def test_parse_once(self):
+		cache = RobotsCache(size=1)
+		parser = cache.get(self.site)
+		self.assertIs(cache.get(self.site), parser)
+		# refreshed robots.txt is parsed again
+		self.site.robots = "User-agent: *\nDisallow: /\n"
+		self.site.robots_updated = timezone.now()
+		self.assertFalse(cache.get(self.site).can_fetch("*", "http://example.com/public"))
+		# least recently used site is dropped
+		cache.get(Site(site_url="other.com"))
+		self.assertNotIn("example.com", cache.parsers)
+
+
+class VisitedSetTest(SimpleTestCase):
+	def test_visited_set(self):
+		for visited in (VisitedSet(), BloomFilter(capacity=1000, error_rate=0.01)):
+			self.assertTrue(visited.add("http://example.com/a"))
+			self.assertTrue(visited.add("http://example.com/b"))
+			self.assertFalse(visited.add("http://example.com/a"))
+			self.assertIn("http://example.com/b", visited)
+			self.assertEqual((visited.hits, visited.misses, len(visited)), (1, 2, 2))
+
+	def test_bloom_filter_error_rate(self):
+		visited = BloomFilter(capacity=10000, error_rate=0.01)
+		for i in range(10000):
+			visited.add("http://example.com/{}".format(i))
+		false_positives = sum("http://other.com/{}".format(i) in visited for i in range(10000))
+		self.assertLess(false_positives, 200)
+
+
+class LinkBufferTest(TestCase):
+	def setUp(self):
+		self.site = Site.objects.create(site_url="example.com")
+		self.page = Page.objects.create(site=self.site, path="/")
+
+	def test_flush(self):
+		links = LinkBuffer(self.page)
+		for i in range(100):
+			links.add("example.com", "/{}".format(i), "http", text="page {}".format(i))
+		links.add("other.com", "/", "https", rel="nofollow")
+		# a select and an insert for each of sites, pages and links, backlinks update and savepoints
+		with self.assertNumQueries(13):
+			links.flush()
+		self.assertEqual(Link.objects.filter(from_url=self.page).count(), 101)
+		self.assertEqual(Page.objects.get(site=self.site, path="/1").backlinks, 1)
+		self.assertEqual(Page.objects.get(site__site_url="other.com").scheme, "https")
+
+		# links removed from page are deleted, and changed ones are updated
+		links.add("example.com", "/1", "http", text="first page")
+		links.add("example.com", "/2", "http", text="page 2")
+		links.flush()
+		self.assertQuerysetEqual(
+			Link.objects.filter(from_url=self.page).order_by('to_url__path'), ["first page", "page 2"], lambda link: link.text
+		)
+		self.assertEqual(Page.objects.count(), 102)
+		self.assertEqual(Page.objects.get(site=self.site, path="/1").backlinks, 1)
+		self.assertEqual(Page.objects.get(site=self.site, path="/3").backlinks, 0)
+
+	def test_concurrent_pages(self):
+		bulk_create = Page.objects.bulk_create
+
+		def create_concurrently(pages):
+			# another crawler creates one of pages meanwhile
+			Page.objects.create(site=self.site, path="/1")
+			return bulk_create(pages)
+		links = LinkBuffer(self.page)
+		for i in range(3):
+			links.add("example.com", "/{}".format(i), "http")
+		with mock.patch.object(Page.objects, 'bulk_create', create_concurrently):
+			links.flush()
+		self.assertEqual(Page.objects.filter(site=self.site, path="/1").count(), 1)
+		self.assertEqual(Link.objects.filter(from_url=self.page).count(), 3)
+
+	def test_add_remove(self):
+		to_url = Page.objects.create(site=self.site, path="/a")
+		link = Link.add(self.page, to_url, "A")
+		Link.add(self.page, to_url, "A", "nofollow")
+		self.assertEqual(Page.objects.get(pk=to_url.pk).backlinks, 1)
+		link.remove()
+		link.remove()
+		self.assertEqual(Page.objects.get(pk=to_url.pk).backlinks, 0)
+
+
+class ImageBufferTest(TestCase):
+	def test_flush(self):
+		page = Page.objects.create(site=Site.objects.create(site_url="example.com"), path="/")
+		images = ImageBuffer(page)
+		images.add("example.com", "/a.png", "A", "a")
+		images.add("cdn.example.com", "/b.png", "B", "b")
+		images.flush()
+		images.add("example.com", "/a.png", "A", "new alt")
+		images.flush()
+		self.assertQuerysetEqual(ImageDetail.objects.filter(page=page), ["new alt"], lambda detail: detail.alt)
+		# images stay, but removed ones are not page's images anymore
+		self.assertEqual(Image.objects.count(), 2)
+
+
+class BlobTest(TestCase):
+	def test_put(self):
+		html = "<html><body>{}</body></html>".format("crawler " * 1000)
+		site = Site.objects.create(site_url="example.com")
+		# pages with the same content share it's blob
+		for path in ("/a", "/b"):
+			Page.objects.create(site=site, path=path, content_hash=Blob.put(html))
+		blob = Blob.objects.get()
+		self.assertEqual(blob.size, len(html))
+		self.assertLess(len(blob.data), len(html) / 10)
+		page = Page.objects.get(path="/a")
+		with self.assertNumQueries(1):
+			self.assertEqual(page.html, html)
+			self.assertEqual(page.html, html)
+		self.assertEqual(Blob.get_texts([blob.pk, "missing"]), {blob.pk: html})
+
+	def test_move_raw_content(self):
+		site = Site.objects.create(site_url="example.com")
+		Page.objects.create(site=site, path="/a", raw_content="<html>A</html>")
+		Page.objects.create(site=site, path="/b", raw_content="<html>A</html>")
+		self.assertEqual(Page.objects.get(path="/a").html, "<html>A</html>")
+		call_command('move-raw-content', batch=1, stdout=StringIO())
+		self.assertFalse(Page.objects.filter(raw_content__isnull=False).exists())
+		self.assertEqual(Blob.objects.get().text, "<html>A</html>")
+		for page in Page.objects.all():
+			self.assertEqual(page.content_hash, Blob.get_hash("<html>A</html>"))
+			self.assertEqual(page.html, "<html>A</html>")
+
+	def test_clean(self):
+		site = Site.objects.create(site_url="example.com")
+		Page.objects.create(site=site, path="/a", content_hash=Blob.put("<html>A</html>"))
+		unused = Blob.put("<html>B</html>")
+		old = Blob.put("<html>C</html>")
+		Blob.objects.filter(pk__in=[Blob.get_hash("<html>A</html>"), old]).update(stored=timezone.now() - timedelta(days=1))
+		call_command('clean-blobs', stdout=StringIO())
+		# an unused content is kept until grace period is passed, it may be put for a page being saved
+		self.assertEqual(sorted(Blob.objects.values_list('pk', flat=True)), sorted([Blob.get_hash("<html>A</html>"), unused]))
+		# putting an existing content renews it
+		Blob.objects.filter(pk=unused).update(stored=timezone.now() - timedelta(days=1))
+		Blob.put("<html>B</html>")
+		call_command('clean-blobs', stdout=StringIO())
+		self.assertTrue(Blob.objects.filter(pk=unused).exists())
+
+
+@mock.patch.object(settings, 'ARTICLE_NLP', "off")
+class CrawlerTest(TestCase):
+	def setUp(self):
+		robots_cache.clear()
+		self.transport = LocalTransport({
+			"http://example.com/robots.txt": (200, {'content-type': "text/plain"}, "User-agent: *\nDisallow: /private\n"),
+			"http://example.com/": """<html><head><title>Home</title></head><body>
+				<a href="/a">A</a> <a href="b" rel="nofollow">B</a> <a href="/private">Private</a>
+				<a href="http://other.com/">Other</a>
+			</body></html>""",
+			"http://example.com/a": "<html><head><title>A</title></head><body><a href='/'>Home</a></body></html>",
+		})
+		self.fetcher = Fetcher(transport=self.transport, scheduler=PolitenessScheduler(delay=0))
+
+	def test_blocked_site(self):
+		site = Site.objects.create(site_url="example.com")
+		site.block()
+		blocked_until = site.blocked_until
+		# saving site for other reasons doesn't extend it's block
+		site.update_robot(self.fetcher.fetch_one(site.get_robots_url()))
+		self.assertEqual(Site.objects.get().blocked_until, blocked_until)
+		self.assertTrue(site.is_blocked())
+		Crawler("http://example.com/", depth=1, fetcher=self.fetcher)
+		self.assertNotIn("http://example.com/", [url for url, headers in self.transport.requests])
+		# url of a blocked site is left queued until it's block time is over
+		item = Frontier(crawl="http://example.com/").queryset().get()
+		self.assertEqual((item.status, item.attempts, item.retry_after), ('Q', 0, blocked_until))
+		# site is crawled again when block time is over
+		Site.objects.update(blocked_until=timezone.now() - timedelta(seconds=1))
+		Crawler("http://example.com/", depth=1, fetcher=self.fetcher)
+		self.assertIn("http://example.com/", [url for url, headers in self.transport.requests])
+		self.assertEqual(Site.objects.get().status, 'A')
+		# a site which is already looked up by crawler is unblocked too
+		crawler = Crawler("http://example.com/", depth=1, fetcher=self.fetcher, start=False)
+		crawler.get_site("example.com").block()
+		crawler.sites["example.com"].blocked_until = timezone.now() - timedelta(seconds=1)
+		self.assertEqual(crawler.get_site("example.com").status, 'A')
+
+	@mock.patch.object(settings, 'CRAWL_RETRIES', 1)
+	@mock.patch.object(settings, 'CRAWL_RETRY_DELAY', 0)
+	def test_retrieval_failed(self):
+		get = self.transport.get
+		failed = []
+
+		async def get_or_fail(url, headers):
+			# a timeout or connection error
+			if url == "http://example.com/a":
+				failed.append(url)
+				return None
+			return await get(url, headers)
+		self.transport.get = get_or_fail
+		crawler = Crawler("http://example.com/", depth=2, fetcher=self.fetcher)
+		# failed url is retried, then it's marked as failed and isn't counted as followed
+		self.assertEqual(failed, ["http://example.com/a"] * 2)
+		self.assertEqual(crawler.followed, 2)  # home and the disallowed /private
+		item = Frontier(crawl="http://example.com/").queryset().get(url="http://example.com/a")
+		self.assertEqual((item.status, item.attempts), ('F', 1))
+
+	def test_crawl(self):
+		crawler = Crawler("http://example.com/", depth=2, fetcher=self.fetcher)
+		requested = [url for url, headers in self.transport.requests]
+		self.assertEqual(requested, ["http://example.com/robots.txt", "http://example.com/", "http://example.com/a"])
+		self.assertEqual(Page.objects.get(path="/a").page_title, "A")
+		self.assertEqual(Page.objects.get(path="/a").html, self.transport.pages["http://example.com/a"])
+		# links to pages that are not allowed or marked as nofollow are stored, but not crawled
+		self.assertEqual(
+			sorted(Link.objects.filter(from_url__path="/").values_list('to_url__path', flat=True)), ["/a", "/b", "/private"]
+		)
+		self.assertIsNone(Page.objects.get(path="/private").status)
+		self.assertFalse(crawler.frontier.queryset().exclude(status='D').exists())
+
+	def test_recrawl(self):
+		self.transport.pages["http://example.com/"] = (200, {'content-type': "text/html", 'etag': '"v1"'}, self.transport.pages["http://example.com/"])
+		Crawler("http://example.com/", depth=2, fetcher=self.fetcher)
+		self.transport.requests = []
+		# unchanged pages are neither parsed nor indexed again, but their stored links are followed
+		with mock.patch('quaero.models.ParsedPage') as parser, mock.patch('quaero.crawler.get_index') as get_index, \
+				mock.patch.object(settings, 'SEARCH_BACKEND', "index"):
+			Crawler("http://example.com/", depth=2, fetcher=self.fetcher)
+		self.assertFalse(parser.called)
+		self.assertFalse(get_index.called)
+		self.assertEqual(self.transport.requests[0], ("http://example.com/", {'User-Agent': settings.USER_AGENT, 'If-None-Match': '"v1"'}))
+		self.assertEqual([url for url, headers in self.transport.requests], ["http://example.com/", "http://example.com/a"])
+		# changed content is parsed again
+		self.transport.pages["http://example.com/a"] = "<html><head><title>New A</title></head><body></body></html>"
+		Crawler("http://example.com/", depth=2, fetcher=self.fetcher)
+		self.assertEqual(Page.objects.get(path="/a").page_title, "New A")
+
+
+@mock.patch.object(settings, 'ARTICLE_NLP', "off")
+class RevisitTest(TestCase):
+	def setUp(self):
+		robots_cache.clear()
+		self.transport = LocalTransport({
+			"http://example.com/": "<html><body><a href='/a'>A</a></body></html>",
+			"http://example.com/a": "<html><body>A</body></html>",
+		})
+		self.fetcher = Fetcher(transport=self.transport, scheduler=PolitenessScheduler(delay=0))
+
+	def revisit(self):
+		# make every page due, and recrawl them
+		Page.objects.update(next_crawl=timezone.now())
+		queue_revisits()
+		Crawler(REVISIT_CRAWL, depth=1, external=True, fetcher=self.fetcher, start=False).run()
+
+	def test_change_rate(self):
+		self.assertIsNone(get_change_rate(0, 0, 0))
+		day = 24 * 60 * 60
+		self.assertEqual(get_change_rate(10, 0, 10 * day), 0)
+		# pages changed on every revisit probably change more than once between revisits
+		self.assertGreater(get_change_rate(10, 10, 10 * day), 1.0)
+		self.assertLess(get_change_rate(10, 5, 10 * day), 1.0)
+		self.assertEqual(get_revisit_interval(None), settings.REVISIT_INITIAL)
+		self.assertEqual(get_revisit_interval(0), settings.REVISIT_MAX)
+		self.assertEqual(get_revisit_interval(1000), settings.REVISIT_MIN)
+		self.assertLess(get_revisit_interval(get_change_rate(10, 5, 10 * day)), get_revisit_interval(get_change_rate(10, 1, 10 * day)))
+
+	def test_revisit(self):
+		Crawler("http://example.com/", depth=2, fetcher=self.fetcher)
+		home = Page.objects.get(path="/")
+		self.assertEqual(home.revisits, 0)
+		self.assertGreater(home.next_crawl, timezone.now())
+		self.assertEqual(pop_due(), [])
+		self.transport.pages["http://example.com/a"] = "<html><body>New A</body></html>"
+		self.transport.requests = []
+		self.revisit()
+		self.assertEqual(sorted(url for url, headers in self.transport.requests), ["http://example.com/", "http://example.com/a"])
+		self.revisit()
+		home, page = Page.objects.get(path="/"), Page.objects.get(path="/a")
+		self.assertEqual((home.revisits, home.changes), (2, 0))
+		self.assertEqual((page.revisits, page.changes), (2, 1))
+		# changed page is due before the unchanged one
+		self.assertLess(page.next_crawl, home.next_crawl)
+		Page.objects.update(next_crawl=timezone.now())
+		self.assertEqual(len(pop_due(1)), 1)
+		self.assertEqual(len(pop_due()), 1)
+		self.assertEqual(pop_due(), [])
+
+	def test_interrupted_revisit(self):
+		Crawler("http://example.com/", depth=1, fetcher=self.fetcher)
+		Page.objects.update(next_crawl=timezone.now())
+		self.assertEqual(queue_revisits(), 1)
+		# a revisit reserves the url and is interrupted, the page is due again later
+		Frontier(crawl=REVISIT_CRAWL).pop()
+		Page.objects.update(next_crawl=timezone.now())
+		self.assertEqual(queue_revisits(), 1)
+		self.transport.requests = []
+		Crawler(REVISIT_CRAWL, depth=1, external=True, fetcher=self.fetcher, start=False).run()
+		self.assertEqual([url for url, headers in self.transport.requests], ["http://example.com/"])
+
+
+def has_punkt():
+	# sentence tokenizer of summaries is a dataset of nltk, it's downloaded at installation
+	try:
+		nltk.data.find('tokenizers/punkt')
+	except LookupError:
+		return False
+	return True
+
+
+requires_punkt = skipUnless(has_punkt(), "nltk punkt dataset isn't downloaded, see README")
+
+
+class NlpTest(TestCase):
+	article = """<html><head><title>Web crawlers</title></head><body><h1>Web crawlers</h1><article>
+		<p>A web crawler visits pages of sites and follows their links to find more pages.</p>
+		<p>Search engines use crawlers to keep their index of the web fresh.</p>
+		<p>Polite crawlers wait between requests to a site, and obey robots.txt of the site.</p>
+		<p>Pages that change often are revisited by crawlers more often than stable pages.</p>
+		<p>A crawler stores the pages it visits, so search engines can search their content.</p>
+	</article></body></html>"""
+
+	def setUp(self):
+		robots_cache.clear()
+		self.transport = LocalTransport({"http://example.com/": self.article})
+		self.fetcher = Fetcher(transport=self.transport, scheduler=PolitenessScheduler(delay=0))
+
+	@requires_punkt
+	def test_summarize(self):
+		# summary and keywords are the same as newspaper's Article.nlp()
+		article = ParsedPage("http://example.com/", self.article).article
+		summary, keywords = summarize(article.title, article.text)
+		article.nlp()
+		self.assertEqual(summary, article.summary)
+		self.assertEqual(sorted(keywords), sorted(article.keywords))
+		self.assertIn("crawlers", keywords)
+		self.assertEqual(summarize(None, None), ("", []))
+
+	def test_process_inline(self):
+		with mock.patch.object(settings, 'ARTICLE_NLP', "inline"), mock.patch.object(settings, 'ARTICLE_NLP_SAMPLE_RATE', 0.5):
+			with mock.patch('quaero.nlp.random.random', return_value=0.3):
+				self.assertTrue(process_inline())
+			with mock.patch('quaero.nlp.random.random', return_value=0.7):
+				self.assertFalse(process_inline())
+		for mode in ("deferred", "off"):
+			with mock.patch.object(settings, 'ARTICLE_NLP', mode):
+				self.assertFalse(process_inline())
+
+	@requires_punkt
+	@mock.patch.object(settings, 'ARTICLE_NLP', "inline")
+	@mock.patch.object(settings, 'ARTICLE_NLP_SAMPLE_RATE', 1.0)
+	def test_inline(self):
+		Crawler("http://example.com/", depth=1, fetcher=self.fetcher)
+		page = Page.objects.get()
+		self.assertTrue(page.article_excerpt)
+		self.assertIn("crawlers", page.article_keywords)
+
+	@mock.patch.object(settings, 'ARTICLE_NLP', "deferred")
+	def test_deferred(self):
+		Crawler("http://example.com/", depth=1, fetcher=self.fetcher)
+		page = Page.objects.get()
+		self.assertIsNone(page.article_excerpt)
+		self.assertIsNone(page.article_keywords)
+		self.assertTrue(page.article_content)
+
+	@requires_punkt
+	def test_process_nlp_command(self):
+		site = Site.objects.create(site_url="example.com")
+		article = ParsedPage("http://example.com/", self.article).article
+		crawled = timezone.now() - timedelta(days=1)
+		for i in range(3):
+			Page.objects.create(
+				site=site, path="/{}".format(i), article_title=article.title, article_content=article.text, last_crawled=crawled
+			)
+		Page.objects.create(site=site, path="/done", article_content=article.text, article_excerpt="Done")
+		call_command('process-nlp', batch=1, limit=2, stdout=StringIO())
+		processed = Page.objects.exclude(path="/done").filter(article_excerpt__isnull=False).order_by('pk')
+		self.assertEqual([page.path for page in processed], ["/0", "/1"])
+		summary, keywords = summarize(article.title, article.text)
+		for page in processed:
+			self.assertEqual((page.article_excerpt, sorted(page.article_keywords)), (summary, sorted(keywords)))
+			# only nlp fields are saved
+			self.assertEqual(page.last_crawled, crawled)
+		# keywords are searched
+		self.assertEqual(Page.objects.filter(search_vector=SearchQuery("crawlers", config=settings.SEARCH_CONFIG)).count(), 2)
+		self.assertEqual(Page.objects.get(path="/done").article_excerpt, "Done")
+		call_command('process-nlp', stdout=StringIO())
+		self.assertFalse(Page.objects.filter(article_excerpt__isnull=True).exists())
+
+	@requires_punkt
+	def test_process_nlp_task(self):
+		site = Site.objects.create(site_url="example.com")
+		article = ParsedPage("http://example.com/", self.article).article
+		page = Page.objects.create(site=site, path="/", article_title=article.title, article_content=article.text)
+		tasks.process_nlp([page.pk])
+		page.refresh_from_db()
+		self.assertEqual(page.article_excerpt, summarize(article.title, article.text)[0])
+		self.assertIsNotNone(page.search_vector)
+
+
+class FrontierTest(TestCase):
+	def setUp(self):
+		self.frontier = Frontier(crawl="http://example.com/", batch_size=2)
+
+	def test_pop(self):
+		self.frontier.push("http://example.com/1", 1)
+		self.frontier.push("http://example.com/3", 3)
+		self.frontier.push("http://example.com/2", 2)
+		self.frontier.push("http://example.com/3b", 3)
+		# urls with more remaining depth are popped first, in order they're queued
+		self.assertEqual([item.url for item in self.frontier.pop()], ["http://example.com/3", "http://example.com/3b"])
+		self.assertEqual([item.url for item in self.frontier.pop()], ["http://example.com/2", "http://example.com/1"])
+		self.assertEqual(self.frontier.pop(), [])
+		# other crawls have their own frontier
+		self.assertTrue(Frontier(crawl="http://other.com/").push("http://example.com/1", 1))
+
+	def test_push_many(self):
+		self.assertTrue(self.frontier.push("http://example.com/a", 2))
+		self.assertFalse(self.frontier.push("http://example.com/a", 1))
+		urls = ["http://example.com/a", "http://example.com/b", "http://example.com/b", "http://example.com/c"]
+		self.assertEqual(self.frontier.push_many(urls, 1), 2)
+		self.assertEqual(self.frontier.push_many(urls, 1), 0)
+		self.assertEqual(len(self.frontier), 3)
+		# depth of a url is the one it's first queued with
+		self.assertEqual(self.frontier.queryset().get(url="http://example.com/a").depth, 2)
+
+	@mock.patch.object(settings, 'CRAWL_RETRIES', 2)
+	@mock.patch.object(settings, 'CRAWL_RETRY_DELAY', 0)
+	def test_fail(self):
+		self.frontier.push("http://example.com/a", 1)
+		for attempt in range(2):
+			item, = self.frontier.pop()
+			self.assertTrue(self.frontier.fail(item))
+		item, = self.frontier.pop()
+		self.assertFalse(self.frontier.fail(item))
+		self.assertEqual(self.frontier.pop(), [])
+		self.assertEqual(self.frontier.queryset().get().status, 'F')
+
+	def test_retry_after(self):
+		self.frontier.push_many(["http://example.com/a", "http://example.com/b"], 1)
+		failed, postponed = self.frontier.pop()
+		# failed and postponed urls are not popped before their retry time
+		self.assertTrue(self.frontier.fail(failed))
+		self.frontier.postpone(postponed, timezone.now() + timedelta(days=1))
+		self.assertEqual(self.frontier.pop(), [])
+		self.assertAlmostEqual(self.frontier.get_retry_wait(), settings.CRAWL_RETRY_DELAY, delta=5)
+		self.frontier.queryset().filter(pk=failed.pk).update(retry_after=None, status='D')
+		self.assertIsNone(self.frontier.get_retry_wait())
+		self.frontier.queryset().filter(pk=failed.pk).update(status='Q')
+		self.frontier.queryset().filter(pk=failed.pk).update(retry_after=timezone.now())
+		self.assertEqual([item.url for item in self.frontier.pop()], [failed.url])
+		# postponing isn't a failed attempt
+		self.assertEqual(self.frontier.queryset().get(pk=postponed.pk).attempts, 0)
+
+	def test_reset(self):
+		self.frontier.push_many(["http://example.com/a", "http://example.com/b", "http://example.com/c"], 1)
+		done, claimed = self.frontier.pop()
+		self.frontier.done(done)
+		# urls claimed by an interrupted crawl are queued again, crawled ones aren't
+		self.assertEqual(self.frontier.reset(), 1)
+		self.assertEqual(len(self.frontier), 2)
+		self.assertEqual(sorted(item.url for item in self.frontier.pop()), sorted([claimed.url, "http://example.com/c"]))
+
+
+@mock.patch.object(settings, 'ARTICLE_NLP', "off")
+class DistributedCrawlTest(TestCase):
+	def setUp(self):
+		robots_cache.clear()
+		tasks.crawlers.clear()
+		# settings are read by celery with CELERY_ namespace
+		celery_app.conf.CELERY_TASK_ALWAYS_EAGER = True
+		self.addCleanup(setattr, celery_app.conf, 'CELERY_TASK_ALWAYS_EAGER', False)
+		self.transport = LocalTransport({
+			"http://example.com/": "<html><body><a href='/a'>A</a> <a href='/b'>B</a></body></html>",
+			"http://example.com/a": "<html><body><a href='/b'>B</a></body></html>",
+			"http://example.com/b": "<html></html>",
+		})
+		fetcher = Fetcher(transport=self.transport, scheduler=PolitenessScheduler(delay=0))
+		patcher = mock.patch('quaero.fetcher.default_fetcher', fetcher)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def test_dispatch(self):
+		Crawler("http://example.com/", depth=3, start=False).start()
+		tasks.dispatch.delay("http://example.com/")
+		requested = sorted(url for url, headers in self.transport.requests)
+		self.assertEqual(requested, [
+			"http://example.com/", "http://example.com/a", "http://example.com/b", "http://example.com/robots.txt"
+		])
+		self.assertFalse(Frontier(crawl="http://example.com/").queryset().exclude(status='D').exists())
+
+	def test_dispatch_options(self):
+		Crawler("http://example.com/", depth=3, start=False).start()
+		with mock.patch('quaero.fetcher.RequestsTransport', return_value=self.transport):
+			tasks.dispatch.delay("http://example.com/", False, 2, "bloom")
+		self.assertEqual(len(self.transport.requests), 4)
+		crawler = tasks.crawlers["http://example.com/", False, 2, "bloom"]
+		self.assertEqual(crawler.fetcher.concurrency, 2)
+		self.assertIsInstance(crawler.visited, BloomFilter)
+		# crawls of a worker are rate limited by one scheduler
+		self.assertIs(crawler.scheduler, tasks.get_fetcher().scheduler)
+
+	def test_queue(self):
+		self.assertEqual(tasks.get_queue("example.com"), tasks.get_queue("example.com"))
+		self.assertTrue(tasks.get_queue("example.com").startswith("crawl-"))
+
+
+class SearchTest(TestCase):
+	def setUp(self):
+		search_cache.clear()
+		site = Site.objects.create(site_url="example.com")
+		self.title = Page.objects.create(site=site, path="/title", page_title="Django crawler")
+		self.content = Page.objects.create(
+			site=site, path="/content", page_title="Home", article_content="a crawler written with django"
+		)
+		Page.objects.create(site=site, path="/other", page_title="Other", article_content="nothing to see")
+		for page in Page.objects.all():
+			page.update_search_vector()
+
+	def test_search_result(self):
+		response = self.client.get("/search/", {'q': "crawlers"})
+		self.assertEqual(response.context['count'], 2)
+		# matches in title rank higher than matches in content
+		self.assertEqual([page.pk for page in response.context['results']], [self.title.pk, self.content.pk])
+
+	@mock.patch.object(settings, 'SEARCH_RANK_WEIGHT', 1.0)
+	def test_search_rank(self):
+		# pages with higher PageRank are ordered first, when their text relevance is close
+		Page.objects.filter(pk=self.content.pk).update(rank=10)
+		response = self.client.get("/search/", {'q': "crawlers"})
+		self.assertEqual([page.pk for page in response.context['results']], [self.content.pk, self.title.pk])
+
+	def test_search_cache(self):
+		response = self.client.get("/search/", {'q': "crawlers"})
+		self.assertEqual(response.context['count'], 2)
+		# same query in other words, is read from cache and only it's pages are loaded
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get("/search/", {'q': " Crawlers "})
+		self.assertFalse([query for query in queries.captured_queries if "ts_rank" in query['sql'] or "COUNT" in query['sql']])
+		self.assertEqual(response.context['count'], 2)
+		self.assertEqual([page.pk for page in response.context['results']], [self.title.pk, self.content.pk])
+		# new pages invalidate cached results
+		page = Page.objects.create(site=self.title.site, path="/new", page_title="Crawler")
+		page.update_search_vector()
+		search_cache.bump("pages")
+		response = self.client.get("/search/", {'q': "crawlers"})
+		self.assertEqual(response.context['count'], 3)
+
+	def test_search_cache_timeout(self):
+		now = time.time()
+		with mock.patch('quaero.cache.time.time', return_value=now):
+			response = self.client.get("/search/", {'q': "crawlers"})
+		self.assertEqual(response.context['count'], 2)
+		# a page stored by a process which doesn't share generation counters, is found when cached results expire
+		page = Page.objects.create(site=self.title.site, path="/new", page_title="Crawler")
+		page.update_search_vector()
+		with mock.patch('quaero.cache.time.time', return_value=now + settings.SEARCH_CACHE_TIMEOUT - 1):
+			response = self.client.get("/search/", {'q': "crawlers"})
+		self.assertEqual(response.context['count'], 2)
+		with mock.patch('quaero.cache.time.time', return_value=now + settings.SEARCH_CACHE_TIMEOUT + 1):
+			response = self.client.get("/search/", {'q': "crawlers"})
+		self.assertEqual(response.context['count'], 3)
+
+	def test_search_images(self):
+		images = ImageBuffer(self.title)
+		images.add("example.com", "/logo.png", "Logo", "quaero")
+		images.add("example.com", "/crawler.png", "Crawler", "a crawler")
+		images.flush()
+		images = ImageBuffer(self.content)
+		images.add("example.com", "/crawler.png", None, "crawler")
+		images.add("example.com", "/other.png", "Other", None)
+		images.flush()
+		# images are ranked by their own title and alt first, then by titles of pages they're in
+		with self.assertNumQueries(3):
+			response = self.client.get("/search/", {'q': "crawler", 't': "images"})
+			urls = [image.get_url() for image in response.context['results']]
+		self.assertEqual(urls, ["//example.com/crawler.png", "//example.com/logo.png"])
+		self.assertEqual(response.context['count'], 2)
+
+	def test_search_index(self):
+		path = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, path)
+		index = Index(path)
+		index.build(Page.objects.order_by('pk').values_list('pk', 'page_title', 'article_content'))
+		self.addCleanup(index.close)
+		with mock.patch.object(settings, 'SEARCH_BACKEND', "index"), mock.patch('quaero.views.get_index', return_value=index):
+			response = self.client.get("/search/", {'q': "crawler"})
+		self.assertEqual(response.context['count'], 2)
+		self.assertEqual([page.pk for page in response.context['results']], [self.title.pk, self.content.pk])
+
+
+class SuggestTest(TestCase):
+	def setUp(self):
+		query_log.clear()
+
+	def test_suggest(self):
+		suggester = Suggester([
+			("Crawler", 3), ("crawl", 5), ("web  crawler", 4), ("crawling the web", 1), ("crawler", 1), ("django", 2)
+		], k=2, prefix_length=4)
+		self.assertEqual(suggester.suggest("cr"), ["crawl", "crawler"])
+		self.assertEqual(suggester.suggest("Craw", k=1), ["crawl"])
+		# prefixes longer than prefix_length are searched in sorted phrases
+		self.assertEqual(suggester.suggest("crawle"), ["crawler"])
+		self.assertEqual(suggester.suggest("crawling"), ["crawling the web"])
+		self.assertEqual(suggester.suggest("search"), [])
+		self.assertEqual(suggester.suggest(" "), [])
+
+	def test_build(self):
+		site = Site.objects.create(site_url="example.com")
+		Page.objects.create(site=site, path="/a", page_title="Crawler", article_keywords=["crawling", "python"])
+		Page.objects.create(site=site, path="/b", page_title="Crawler", article_keywords=["crawling"])
+		with mock.patch.object(query_log, 'size', 2):
+			self.client.get("/search/", {'q': "Crawl  the web"})
+			self.client.get("/search/", {'q': "crawl the web"})
+		self.assertEqual(QueryLog.objects.get().count, 2)
+		path = os.path.join(tempfile.mkdtemp(), "suggestions.pickle")
+		self.addCleanup(shutil.rmtree, os.path.dirname(path))
+		build_suggestions(path)
+		with mock.patch('quaero.views.suggestions', SuggestionsFile(path)):
+			response = self.client.get("/suggest/", {'q': "cr"})
+		self.assertEqual(response.json()['suggestions'], ["crawl the web", "crawler", "crawling"])
+
+
+class ListingTest(TestCase):
+	def setUp(self):
+		search_cache.clear()
+		site = Site.objects.create(site_url="example.com", robots="User-agent: *\n" * 100)
+		for i in range(25):
+			page = Page.objects.create(
+				site=site, path="/{}".format(i), page_title="Crawler {}".format(i), article_excerpt="A crawler",
+				article_content="crawler " * 10000, meta={'links': ["/{}".format(i)] * 1000},
+			)
+			page.update_search_vector()
+
+	def get_size(self, pages):
+		# size of loaded values of pages and their sites
+		size = 0
+		for page in pages:
+			for item in (page, page.site):
+				size += sum(len(str(value)) for name, value in item.__dict__.items() if not name.startswith('_'))
+		return size
+
+	def assertLight(self, pages):
+		self.assertEqual(len(pages), 20)
+		for page in pages:
+			self.assertIn('article_content', page.get_deferred_fields())
+		self.assertLess(self.get_size(pages), 20 * 200)
+
+	def test_site_pages_list(self):
+		with self.assertNumQueries(1):
+			response = self.client.get("/pages/example.com")
+		self.assertLight(response.context['site_pages'])
+
+	def test_search_result(self):
+		with self.assertNumQueries(3):
+			response = self.client.get("/search/", {'q': "crawler"})
+		self.assertLight(response.context['results'])
+		# pages of cached results are loaded the same way
+		with self.assertNumQueries(1):
+			response = self.client.get("/search/", {'q': "crawler"})
+		self.assertLight(response.context['results'])
+
+	def test_search_images(self):
+		images = ImageBuffer(Page.objects.get(path="/1"))
+		for i in range(25):
+			images.add("cdn{}.example.com".format(i), "/{}.png".format(i), "Crawler {}".format(i))
+		images.flush()
+		# urls of images of different sites are rendered without querying their sites
+		with self.assertNumQueries(3):
+			response = self.client.get("/search/", {'q': "crawler", 't': "images"})
+		self.assertEqual(len(response.context['results']), 20)
+		image = response.context['results'][0]
+		self.assertContains(response, 'src="//cdn{}.example.com/{}.png"'.format(image.path[1:-4], image.path[1:-4]))
+
+	def test_urls(self):
+		site_urls.clear()
+		pages = list(Page.objects.order_by('pk'))
+		# site of pages is looked up once, even if it's not loaded with pages
+		with self.assertNumQueries(1):
+			urls = [page.get_url() for page in pages]
+			addresses = [str(page) for page in pages]
+		self.assertEqual(urls[0], "http://example.com/0")
+		self.assertEqual(urls, addresses)
+
+	@mock.patch.object(settings, 'SITE_URL_CACHE_SIZE', 2)
+	def test_urls_eviction(self):
+		site_urls.clear()
+		pages = [Page.objects.create(site=Site.objects.create(site_url="{}.com".format(i)), path="/") for i in range(3)]
+		pages = list(Page.objects.filter(pk__in=[page.pk for page in pages]).order_by('pk'))
+		with self.assertNumQueries(3):
+			pages[0].get_url()
+			pages[1].get_url()
+			# a recently used site is kept, and the least recently used one is evicted
+			pages[0].get_url()
+			pages[2].get_url()
+		with self.assertNumQueries(0):
+			self.assertEqual(pages[0].get_url(), "http://0.com/")
+		with self.assertNumQueries(1):
+			self.assertEqual(pages[1].get_url(), "http://1.com/")
+
+	def test_site_page(self):
+		with self.assertNumQueries(2):
+			response = self.client.get("/page/example.com/1")
+		self.assertEqual(response.context['page'].article_content, "crawler " * 10000)
+		self.assertIn('search_vector', response.context['page'].get_deferred_fields())
+
+
+class IndexTest(SimpleTestCase):
+	documents = [
+		(1, "Django crawler", "a web crawler written with django"),
+		(2, "Home", "nothing about crawling"),
+		(3, "Crawler", "crawler crawler crawler"),
+	]
+
+	def setUp(self):
+		self.path = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.path)
+
+	def test_search(self):
+		index = Index(self.path)
+		index.build(self.documents, segment_size=2)
+		self.addCleanup(index.close)
+		self.assertEqual(len(index.segments), 2)
+		count, top = index.search("django crawler")
+		self.assertEqual(count, 2)
+		self.assertEqual([page_id for score, page_id in top], [1, 3])
+		self.assertEqual(index.search("django crawler", k=1)[1][0][1], 1)
+		self.assertEqual(index.search("missing")[0], 0)
+
+	def test_segments(self):
+		# scores don't depend on how pages are split between segments
+		index = Index(self.path)
+		index.build(self.documents, segment_size=1)
+		split = dict((page_id, score) for score, page_id in index.search("crawler")[1])
+		index.build(self.documents)
+		merged = dict((page_id, score) for score, page_id in index.search("crawler")[1])
+		index.close()
+		self.assertEqual(split.keys(), merged.keys())
+		for page_id in split:
+			self.assertAlmostEqual(split[page_id], merged[page_id])
+
+	def test_positions(self):
+		index = Index(self.path)
+		index.build(self.documents)
+		self.addCleanup(index.close)
+		self.assertEqual(list(index.segments[0].postings("crawler", positions=True)), [(0, 2, [1, 4]), (2, 4, [0, 1, 2, 3])])
+
+	@mock.patch.object(settings, 'SEARCH_INDEX_MERGE_FACTOR', 3)
+	def test_update(self):
+		index = Index(self.path)
+		self.addCleanup(index.close)
+		index.update(self.documents[:1])
+		index.update([(2, "Crawler", "changed page")])
+		self.assertEqual(len(index.segments), 2)
+		# segments of the same size are merged in background
+		index.update([(1, "Home", "nothing about crawling")])
+		index.merge_thread.join()
+		self.assertEqual(len(index.segments), 1)
+		self.assertEqual(len(index), 2)
+		self.assertEqual([page_id for score, page_id in index.search("crawler")[1]], [2])
+		# another process sees the same segments
+		reader = Index(self.path)
+		self.addCleanup(reader.close)
+		self.assertEqual(reader.search("crawling")[1][0][1], 1)
+
+	@mock.patch.object(settings, 'SEARCH_INDEX_BACKGROUND_MERGE', False)
+	def test_delete(self):
+		index = Index(self.path)
+		self.addCleanup(index.close)
+		index.build(self.documents)
+		index.delete([3])
+		self.assertEqual(len(index), 2)
+		self.assertEqual([page_id for score, page_id in index.search("crawler")[1]], [1])
+		self.assertEqual(index.search("crawling")[0], 1)
+		# segment with more deleted than live documents is rewritten
+		index.delete([1])
+		index.maybe_merge()
+		self.assertEqual(index.segments[0].doc_count, 1)
+		self.assertEqual(len(os.listdir(self.path)), 3)  # lock, manifest and one segment
+
+	@mock.patch.object(settings, 'SEARCH_INDEX_BACKGROUND_MERGE', False)
+	def test_top(self):
+		# top k documents with early termination are the same as scoring every document
+		words = ["w{}".format(i) for i in range(30)]
+		generator = random.Random(1)
+		documents = [
+			(page_id, "", " ".join(generator.choice(words[:5] + words) for i in range(generator.randint(1, 60))))
+			for page_id in range(1, 1001)
+		]
+		index = Index(self.path)
+		self.addCleanup(index.close)
+		index.build(documents, segment_size=400)
+		index.delete(range(1, 1001, 7))
+		index.write_priors((page_id, generator.random() * 5, generator.randint(0, 100)) for page_id in range(1, 1001, 2))
+		for query in ("w0", "w1 w20", "w2 w3 w29 w10", "w29 missing"):
+			count, expected = index.search(query, k=50)
+			for k in (1, 10, 50):
+				top = index.top(query, k)
+				self.assertEqual([page_id for score, page_id in top], [page_id for score, page_id in expected[:k]])
+				for (score, page_id), (expected_score, expected_page_id) in zip(top, expected):
+					self.assertAlmostEqual(score, expected_score)
+			self.assertTrue(index.count(query) >= count)
+
+
+class PageRankTest(TestCase):
+	def test_pagerank(self):
+		site = Site.objects.create(site_url="example.com")
+		home, a, b, alone = [Page.objects.create(site=site, path=path) for path in ("/", "/a", "/b", "/alone")]
+		Link.objects.create(from_url=home, to_url=a)
+		Link.objects.create(from_url=home, to_url=b)
+		Link.objects.create(from_url=a, to_url=home)
+		Link.objects.create(from_url=b, to_url=home)
+		Link.objects.create(from_url=b, to_url=a, rel="nofollow")
+
+		page_ids, indptr, indices = load_graph(batch_size=2)
+		self.assertEqual(list(page_ids), [home.pk, a.pk, b.pk, alone.pk])
+		self.assertEqual(list(indptr), [0, 2, 3, 4, 4])
+		ranks, iterations = pagerank(indptr, indices)
+		self.assertAlmostEqual(ranks.sum(), 1)
+		self.assertAlmostEqual(ranks[1], ranks[2])
+		self.assertTrue(ranks[0] > ranks[1] > ranks[3])
+
+		save_ranks(page_ids, ranks, batch_size=3)
+		self.assertAlmostEqual(Page.objects.get(pk=home.pk).rank, ranks[0])
+		self.assertAlmostEqual(Page.objects.get(pk=alone.pk).rank, ranks[3])
+
+
+class PaginationTest(TestCase):
+	def setUp(self):
+		search_cache.clear()
+		self.site = Site.objects.create(site_url="example.com")
+		for i in range(45):
+			Site.objects.create(site_url="site{:02d}.com".format(i))
+		# a path is unique in a site, but pages of many sites may have the same path and empty paths aren't unique
+		paths = ["/{}".format(i) for i in range(5)] + [None] * 22
+		for path in paths:
+			Page.objects.create(site=self.site, path=path)
+
+	def walk(self, url, key):
+		# follow links of pages until the last one, and return items of all pages
+		items = []
+		query = ""
+		while query is not None:
+			page = self.client.get(url + "?" + query).context[key]
+			items.append([item.pk for item in page])
+			query = page.next_query
+		return items, page
+
+	def test_site_list(self):
+		pages, last = self.walk("/sites", 'sites')
+		self.assertEqual([len(page) for page in pages], [20, 20, 6])
+		self.assertEqual(sum(pages, []), list(Site.objects.order_by('-site_url').values_list('pk', flat=True)))
+		# pages before the last page
+		previous = self.client.get("/sites?" + last.previous_query).context['sites']
+		self.assertEqual([site.pk for site in previous], pages[1])
+		self.assertEqual(previous.first_query, "")
+
+	def test_site_pages_list(self):
+		# pages with empty paths are all listed once
+		pages, last = self.walk("/pages/example.com", 'site_pages')
+		expected = list(Page.objects.filter(site=self.site).order_by('-path', '-pk').values_list('pk', flat=True))
+		self.assertEqual(sum(pages, []), expected)
+		previous = self.client.get("/pages/example.com?" + last.previous_query).context['site_pages']
+		self.assertEqual([page.pk for page in previous], expected[:20])
+
+	def test_count(self):
+		paginator = KeysetPaginator(Site.objects.all(), ['site_url'])
+		self.assertEqual(paginator.count, 46)
+		with mock.patch.object(settings, 'PAGINATION_EXACT_COUNT_LIMIT', 0):
+			self.assertIsInstance(get_count(Page.objects.filter(site=self.site)), int)
+
+	def test_search_index(self):
+		path = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, path)
+		index = Index(path)
+		self.addCleanup(index.close)
+		index.build((page_id, "page", "") for page_id in Page.objects.values_list('pk', flat=True))
+		paginator = KeysetPaginator(SearchResults(index, "page", Page.objects.all()), ['-search_rank', 'pk'], per_page=10)
+		first = paginator.page()
+		second = paginator.page(after=QueryDict(first.next_query)['after'])
+		self.assertEqual([page.pk for page in first] + [page.pk for page in second], [page_id for score, page_id in index.top("page", 20)])
+		previous = paginator.page(before=QueryDict(second.previous_query)['before'])
+		self.assertEqual([page.pk for page in previous], [page.pk for page in first])
+		self.assertFalse(previous.has_previous())
+
+	def test_search_images_walk(self):
+		search_cache.clear()
+		pages = list(Page.objects.order_by('pk')[:5])
+		for i, page in enumerate(pages):
+			Page.objects.filter(pk=page.pk).update(page_title="crawler " * i + "page {}".format(i))
+			page.page_title = "crawler " * i + "page {}".format(i)
+		# images found in several pages sum their fractional ranks, and many of them are tied
+		for i, page in enumerate(pages):
+			images = ImageBuffer(page)
+			for j in range(i, 45, 2 + i % 2):
+				images.add("example.com", "/{}.png".format(j), "Image {}".format(j), "crawler " * (j % 3) + "image")
+			images.flush()
+		query = "q=crawler&t=images"
+		forward = []
+		while query is not None:
+			page = self.client.get("/search/?" + query).context['results']
+			forward.append([image.pk for image in page])
+			query = page.next_query
+		search_query = SearchQuery("crawler", config=settings.SEARCH_CONFIG)
+		ranked = Image.objects.filter(imagedetail__search_vector=search_query).annotate(
+			search_rank=Sum(SearchRank(F('imagedetail__search_vector'), search_query))
+		).order_by('-search_rank', 'pk')
+		# ranks are tied
+		self.assertLess(len(set(ranked.values_list('search_rank', flat=True))), len(ranked))
+		self.assertEqual(sum(forward, []), [image.pk for image in ranked])
+		backward = [forward[-1]]
+		while page.has_previous():
+			page = self.client.get("/search/?" + page.previous_query).context['results']
+			backward.append([image.pk for image in page])
+		self.assertEqual(backward[::-1], forward)
+
+	def test_search_index_walk(self):
+		path = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, path)
+		index = Index(path)
+		self.addCleanup(index.close)
+		# several terms, lengths and priors make fractional scores summed from many parts, some of them tied
+		words = ["crawler", "web", "python", "search", "index", "page", "link", "site"]
+		generator = random.Random(3)
+		rows = []
+		for page_id in Page.objects.order_by('pk').values_list('pk', flat=True):
+			title = " ".join(generator.choice(words) for i in range(generator.randint(1, 4)))
+			rows.append((page_id, title, " ".join(generator.choice(words) for i in range(generator.randint(1, 30)))))
+		index.build(rows[:15])
+		index.update(rows[15:])
+		index.write_priors((page_id, generator.choice([0, 0.1, 0.37, 1.3]), generator.randint(0, 3)) for page_id, title, content in rows)
+		for query in ("crawler web python index", "search page link site crawler", "web site"):
+			for per_page in (2, 3, 4, 5):
+				paginator = KeysetPaginator(SearchResults(index, query, Page.objects.all()), ['-search_rank', 'pk'], per_page=per_page)
+				page = paginator.page()
+				forward = [[item.pk for item in page]]
+				while page.has_next():
+					page = paginator.page(after=QueryDict(page.next_query)['after'])
+					forward.append([item.pk for item in page])
+				self.assertEqual(sum(forward, []), [page_id for score, page_id in index.top(query, 100)])
+				# walking back from the last page gives the same pages
+				backward = [forward[-1]]
+				while page.has_previous():
+					page = paginator.page(before=QueryDict(page.previous_query)['before'])
+					backward.append([item.pk for item in page])
+				self.assertEqual(backward[::-1], forward)
@@ -1,12 +1,17 @@
-from itertools import chain
-
+from django.http import JsonResponse
 from django.shortcuts import render, get_object_or_404
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.db.models import Q
+from django.db.models import F, Sum, ExpressionWrapper, FloatField, DecimalField
+from django.db.models.functions import Cast
+from django.contrib.postgres.search import SearchQuery, SearchRank
 
 from urllib.parse import urlparse
 
-from .models import Site, Page, ImageDetail, Image
+from project import settings
+from project.pagination import paginate, KeysetPage
+from .cache import search_cache
+from .index import get_index, SearchResults
+from .models import Site, Page, ImageDetail, Image, get_prior_expression
+from .suggest import suggestions, query_log
 
 
 def search_home(request):
@@ -16,141 +21,78 @@ def search_home(request):
 def search_result(request):
 	query = request.GET.get('q')
 	search_type = request.GET.get('t')
+	search_query = SearchQuery(query or "", config=settings.SEARCH_CONFIG)
+	if query and not ('after' in request.GET or 'before' in request.GET):
+		query_log.add(query)
+	# result pages are cached until crawler stores new pages
+	cursor = "after:{}".format(request.GET['after']) if 'after' in request.GET else "before:{}".format(request.GET.get('before', ""))
 
 	if search_type == "images":
-		# Search Image Tags
-		results1 = ImageDetail.objects.filter(
-			Q(title__icontains=query) | Q(alt__icontains=[query])
-		)
-		# Get images located in related pages
-		results2 = ImageDetail.objects.filter(
-			Q(page__page_title__icontains=query) | Q(page__article_keywords__icontains=[query]) |
-			Q(page__article_title__icontains=query) | Q(page__article_content__icontains=query)
-		)
-		# sort and add more popular images at top
-		images = {}
-		results = []
-		#top_results = button_results = set()
-		for item in chain(results1, results2):
-			item_url = item.image.get_url()
-			if item_url in images:
-				if item in results1:
-					images[item_url]['rank'] += 10
-				if item in results2:
-					images[item_url]['rank'] += 1
-			else:
-				rank = 1
-				if item in results1:
-					rank += 10
-				if item in results2:
-					rank += 1
-				images[item_url] = {'image': item, 'rank': rank}
-		sorted_images = sorted(images, key=lambda x: x[rank])
-		for item in sorted_images:
-			results.append(images[item]['image'])
-		# Merge two results
-		#results = list(chain(top_results, button_results))
-		count = len(results)
-
-		page = request.GET.get('page', 1)
-		paginator = Paginator(results, 20)
-		adjacent_pages = 5
-		page = int(page)
-		start_page = max(page - adjacent_pages, 1)
-		if start_page <= 3: start_page = 1
-		end_page = page + adjacent_pages + 1
-		if end_page >= paginator.num_pages - 1: end_page = paginator.num_pages + 1
-		try:
-			results = paginator.page(page)
-		except PageNotAnInteger:
-			results = paginator.page(1)
-		except EmptyPage:
-			results = paginator.page(paginator.num_pages)
-
-		context = {
-			'query': query,
-			'results': results,
-			'count': count,
-			'paginator_range': range(start_page, end_page),
-		}
-		return render(request, "search-image-result.html", context)
+		key = search_cache.get_key("images", query, cursor, ["images"])
+		state = search_cache.get(key)
+		if state is not None:
+			results = KeysetPage.from_state(state, Image.objects.select_related('site'))
+		else:
+			# details of images are GIN indexed, an image found in several pages is ranked by sum of their relevance.
+			# relevance is a float4, it's rounded to numeric so the sum is exact and cursors compare equal to it
+			relevance = Cast(SearchRank(F('imagedetail__search_vector'), search_query), DecimalField(max_digits=12, decimal_places=6))
+			results = Image.objects.select_related('site').filter(imagedetail__search_vector=search_query).annotate(
+				search_rank=Sum(relevance)
+			)
+			results = paginate(request, results, ['-search_rank', 'pk'])
+			search_cache.set(key, results.get_state())
+		template = "search-image-result.html"
 	else:
-		results = Page.objects.filter(
-			Q(page_title__icontains=query) | Q(article_keywords__icontains=[query]) |
-			Q(article_title__icontains=query) | Q(article_content__icontains=query)
-		)
-		count = results.count()
-
-		page = request.GET.get('page', 1)
-		paginator = Paginator(results, 20)
-		adjacent_pages = 5
-		page = int(page)
-		start_page = max(page - adjacent_pages, 1)
-		if start_page <= 3: start_page = 1
-		end_page = page + adjacent_pages + 1
-		if end_page >= paginator.num_pages - 1: end_page = paginator.num_pages + 1
-		try:
-			results = paginator.page(page)
-		except PageNotAnInteger:
-			results = paginator.page(1)
-		except EmptyPage:
-			results = paginator.page(paginator.num_pages)
-
-		context = {
-			'query': query,
-			'results': results,
-			'count': count,
-			'paginator_range': range(start_page, end_page),
-		}
-		return render(request, "search-result.html", context)
+		key = search_cache.get_key("pages", query, cursor, ["pages"])
+		state = search_cache.get(key)
+		if state is not None:
+			results = KeysetPage.from_state(state, Page.objects.listing())
+		else:
+			if settings.SEARCH_BACKEND == "index":
+				# pages are ranked by inverted index, and only pages of current result page are loaded
+				results = SearchResults(get_index(), query, Page.objects.listing())
+			else:
+				# full text search over pages' search_vector, which is GIN indexed, ordered by relevance and page's prior
+				results = Page.objects.listing().filter(search_vector=search_query).annotate(
+					search_rank=ExpressionWrapper(
+						SearchRank(F('search_vector'), search_query) + get_prior_expression(), output_field=FloatField()
+					)
+				)
+			results = paginate(request, results, ['-search_rank', 'pk'])
+			search_cache.set(key, results.get_state())
+		template = "search-result.html"
+
+	context = {
+		'query': query,
+		'results': results,
+		'count': results.count,
+	}
+	return render(request, template, context)
+
+
+def suggest(request):
+	"""
+	Suggested queries starting with ``q``, for type-ahead of search box.
+	"""
+	query = request.GET.get('q', "")
+	return JsonResponse({'query': query, 'suggestions': suggestions.suggest(query)})
+
 
 def site_list(request):
-	sites = Site.objects.order_by('-site_url').all()
-
-	page = request.GET.get('page', 1)
-	paginator = Paginator(sites, 20)
-	adjacent_pages = 5
-	page = int(page)
-	start_page = max(page - adjacent_pages, 1)
-	if start_page <= 3: start_page = 1
-	end_page = page + adjacent_pages + 1
-	if end_page >= paginator.num_pages - 1: end_page = paginator.num_pages + 1
-	try:
-		sites = paginator.page(page)
-	except PageNotAnInteger:
-		sites = paginator.page(1)
-	except EmptyPage:
-		sites = paginator.page(paginator.num_pages)
+	sites = paginate(request, Site.objects.all(), ['-site_url'])
 
 	context = {
 		'sites': sites,
-		'paginator_range': range(start_page, end_page),
 	}
 	return render(request, "site-list.html", context)
 
 
 def site_pages_list(request, site_url):
-	site_pages = Page.objects.filter(site__site_url=site_url).order_by('-path')
-
-	page = request.GET.get('page', 1)
-	paginator = Paginator(site_pages, 20)
-	adjacent_pages = 5
-	page = int(page)
-	start_page = max(page - adjacent_pages, 1)
-	if start_page <= 3: start_page = 1
-	end_page = page + adjacent_pages + 1
-	if end_page >= paginator.num_pages - 1: end_page = paginator.num_pages + 1
-	try:
-		site_pages = paginator.page(page)
-	except PageNotAnInteger:
-		site_pages = paginator.page(1)
-	except EmptyPage:
-		site_pages = paginator.page(paginator.num_pages)
+	site_pages = paginate(request, Page.objects.listing().filter(site__site_url=site_url), ['-path', '-pk'])
 
 	context = {
 		'site_url': site_url,
 		'site_pages': site_pages,
-		'paginator_range': range(start_page, end_page),
 	}
 	return render(request, "site-pages-list.html", context)
 
@@ -166,8 +108,8 @@ def site_page(request, url):
 	if path[0:2] == "./":
 		path = path[1:]
 
-	page = get_object_or_404(Page, site__site_url=site_url, path=path)
-	page_images = ImageDetail.objects.filter(page=page)
+	page = get_object_or_404(Page.objects.detail(), site__site_url=site_url, path=path)
+	page_images = ImageDetail.objects.filter(page=page).select_related('image__site')
 	context = {
 		'page': page,
 		'page_images': page_images,
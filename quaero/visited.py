@@ -0,0 +1,82 @@
+import math
+from hashlib import blake2b
+
+from project import settings
+
+
+class VisitedSet(object):
+	"""
+	Exact set of urls seen during a crawl, with O(1) lookups.
+	``hits`` counts urls that were already seen, ``misses`` counts new urls.
+	"""
+	def __init__(self):
+		self.urls = set()
+		self.hits = 0
+		self.misses = 0
+
+	def __contains__(self, url):
+		return url in self.urls
+
+	def __len__(self):
+		return len(self.urls)
+
+	def add(self, url):
+		"""
+		:return: True if url is new, False if it's already seen
+		"""
+		if url in self:
+			self.hits += 1
+			return False
+		self.urls.add(url)
+		self.misses += 1
+		return True
+
+
+class BloomFilter(VisitedSet):
+	"""
+	Memory bounded set of urls for huge crawls. Membership test can be a false positive with ``error_rate``
+	probability once ``capacity`` urls are added, which means a new url may be skipped, but a seen url is never crawled twice.
+	"""
+	def __init__(self, capacity=None, error_rate=None):
+		super().__init__()
+		capacity = capacity or settings.CRAWL_VISITED_CAPACITY
+		error_rate = error_rate or settings.CRAWL_VISITED_ERROR_RATE
+		# optimal number of bits and hash functions for capacity and error rate
+		self.size = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+		self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+		self.bits = bytearray((self.size + 7) // 8)
+		self.count = 0
+
+	def get_indexes(self, url):
+		# double hashing, k indexes are generated from two 64bit hashes
+		digest = blake2b(url.encode('utf-8'), digest_size=16).digest()
+		h1 = int.from_bytes(digest[:8], 'little')
+		h2 = int.from_bytes(digest[8:], 'little') | 1
+		return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+	def __contains__(self, url):
+		return all(self.bits[i >> 3] & (1 << (i & 7)) for i in self.get_indexes(url))
+
+	def __len__(self):
+		return self.count
+
+	def add(self, url):
+		indexes = self.get_indexes(url)
+		if all(self.bits[i >> 3] & (1 << (i & 7)) for i in indexes):
+			self.hits += 1
+			return False
+		for i in indexes:
+			self.bits[i >> 3] |= 1 << (i & 7)
+		self.count += 1
+		self.misses += 1
+		return True
+
+
+def get_visited_set(mode=None):
+	"""
+	:param mode: "exact" or "bloom", default is CRAWL_VISITED_MODE setting
+	"""
+	mode = mode or settings.CRAWL_VISITED_MODE
+	if mode == "bloom":
+		return BloomFilter()
+	return VisitedSet()